@@ -0,0 +1,187 @@
+# Модуль асинхронного режима работы с файловой системой для библиотек на сетевых дисках (NFS, SMB).
+# Каждое обращение к файловой системе на таком диске - сетевой запрос, поэтому независимые обращения
+# выполняются одновременно в ограниченном пуле потоков через asyncio.
+
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from move_plan import move_path
+
+
+class AsyncFS:
+    # Выполняет обращения к файловой системе в пуле из `concurrency` потоков.
+    # Для проверки на локальной папке к каждому обращению можно добавить искусственную задержку `latency`.
+
+    def __init__(self, concurrency=16, latency=0.0):
+        # Принимает `concurrency` - число одновременных обращений и `latency` - задержка обращения в секундах.
+
+        self.concurrency = concurrency
+        self.latency = latency
+        self.executor = ThreadPoolExecutor(max_workers=concurrency)
+
+    def run(self, coroutine):
+        # Выполняет корутину в новом цикле событий и возвращает ее результат.
+
+        return asyncio.run(coroutine)
+
+    def invoke(self, function, *args):
+        # Выполняется в потоке пула: вызывает функцию после искусственной задержки.
+
+        if self.latency:
+            time.sleep(self.latency)
+        return function(*args)
+
+    async def call(self, function, *args):
+        # Выполняет одно обращение к файловой системе в пуле потоков.
+
+        return await asyncio.get_running_loop().run_in_executor(self.executor, self.invoke, function, *args)
+
+    async def map(self, function, items):
+        # Применяет функцию к элементам, выполняя не более `concurrency` обращений одновременно.
+        # Принимает функцию `function` и список `items` (элемент - аргумент или кортеж аргументов).
+        # Возвращает список результатов в порядке элементов; исключение вызова возвращается как результат.
+
+        results = [None] * len(items)
+        pending = iter(enumerate(items))
+
+        async def worker():
+            for number, item in pending:
+                try:
+                    results[number] = await self.call(function, *(item if isinstance(item, tuple) else (item,)))
+                except Exception as e:
+                    results[number] = e
+
+        await asyncio.gather(*(worker() for _ in range(min(self.concurrency, len(items)))))
+        return results
+
+    async def walk(self, top):
+        # Обходит дерево папок: папки одного уровня читаются одновременно.
+        # Принимает строку `top` - корневая папка.
+        # Возвращает список кортежей (папка, подпапки, файлы) в том же порядке, что и os.walk.
+
+        listings = {}
+        level = [top]
+        while level:
+            results = await self.map(list_folder, level)
+            next_level = []
+            for root, listing in zip(level, results):
+                if isinstance(listing, Exception):
+                    continue  # Как и os.walk, пропускает нечитаемые папки
+                listings[root] = listing
+                next_level.extend(os.path.join(root, folder) for folder in listing[0])
+            level = next_level
+
+        tree = []
+        stack = [top] if top in listings else []
+        while stack:
+            root = stack.pop()
+            folders, files = listings[root]
+            tree.append((root, folders, files))
+            stack.extend(reversed([os.path.join(root, folder) for folder in folders
+                                   if os.path.join(root, folder) in listings]))
+        return tree
+
+    async def create_author_dict(self, folder_author):
+        # Асинхронный вариант main.create_author_dict: папки авторов читаются одновременно.
+        # Принимает `folder_author` - путь к папке авторов.
+        # Возвращает словарь авторов в том же порядке, что и create_author_dict.
+
+        listing = await self.call(list_folder_if_exists, folder_author, True)
+        if listing is None:
+            return {}
+        folders = listing[0]
+        results = await self.map(list_folder, [(os.path.join(folder_author, folder), True) for folder in folders])
+        return {folder: set(result[1]) for folder, result in zip(folders, results)
+                if not isinstance(result, Exception)}
+
+    async def build_path_index(self, base_folder):
+        # Асинхронный вариант main.build_path_index.
+
+        path_index = {}
+        for root, folders, files in await self.walk(base_folder):
+            for file in files:
+                path_index.setdefault(file, os.path.join(root, file))
+        return path_index
+
+    async def existing_files(self, paths):
+        # Проверяет существование файлов одновременно.
+        # Принимает список `paths` - пути к файлам.
+        # Возвращает множество путей существующих файлов.
+
+        results = await self.map(os.path.isfile, paths)
+        return {path for path, exists in zip(paths, results) if exists is True}
+
+    async def execute_moves(self, moves, folders):
+        # Выполняет перемещения плана: сначала одновременно создаются нужные папки (каждая один раз),
+        # затем одновременно выполняются перемещения - в разные файлы, поэтому их порядок не важен.
+        # Принимает список `moves` - пары (исходный путь, итоговый путь) с разными итоговыми путями
+        # и множество `folders` - уже созданные папки (дополняется).
+        # Возвращает список результатов перемещений (None или исключение).
+
+        missing = list(dict.fromkeys(os.path.dirname(destination) for source, destination in moves
+                                     if os.path.dirname(destination) not in folders))
+        errors = {}
+        for folder, result in zip(missing, await self.map(make_folder, missing)):
+            if result is None:
+                folders.add(folder)
+            else:
+                errors[folder] = result
+        results = [errors.get(os.path.dirname(destination)) for source, destination in moves]
+        ready = [number for number, result in enumerate(results) if result is None]
+        for number, result in zip(ready, await self.map(move_path, [moves[number] for number in ready])):
+            results[number] = result
+        return results
+
+    async def remove_empty_folders(self, base_folder='books'):
+        # Асинхронный вариант main.remove_empty_folders: папки одного уровня проверяются одновременно,
+        # вложенные папки обрабатываются раньше родительских, чтобы освободившийся родитель тоже удалялся.
+
+        levels = {}
+        for root, folders, files in await self.walk(base_folder):
+            depth = root.count(os.sep)
+            levels.setdefault(depth, []).extend(os.path.join(root, folder) for folder in folders)
+        for depth in sorted(levels, reverse=True):
+            for folder, result in zip(levels[depth], await self.map(remove_if_empty, levels[depth])):
+                if isinstance(result, Exception):
+                    print(f"Error removing empty folder {folder}: {result}")
+
+    def close(self):
+        # Останавливает пул потоков.
+
+        self.executor.shutdown()
+
+
+def list_folder(folder, follow_symlinks=False):
+    # Читает папку за одно обращение. Файлами считаются обычные файлы и ссылки на них (как os.path.isfile).
+    # Ссылки на папки считаются подпапками только при `follow_symlinks` (как os.path.isdir в create_author_dict);
+    # walk их не учитывает, чтобы обход, как и os.walk, не заходил в ссылки.
+    # Возвращает кортеж (список подпапок, список файлов) в порядке os.listdir.
+
+    folders, files = [], []
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=follow_symlinks):
+                folders.append(entry.name)
+            elif entry.is_file():
+                files.append(entry.name)
+    return folders, files
+
+
+def list_folder_if_exists(folder, follow_symlinks=False):
+    # Читает папку; возвращает None, если папки нет.
+
+    return list_folder(folder, follow_symlinks) if os.path.exists(folder) else None
+
+
+def make_folder(folder):
+    # Создает папку со всеми родительскими, если ее нет.
+
+    os.makedirs(folder, exist_ok=True)
+
+
+def remove_if_empty(folder):
+    # Удаляет папку, если она пуста.
+
+    if not os.listdir(folder):
+        os.rmdir(folder)
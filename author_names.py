@@ -0,0 +1,318 @@
+# Модуль канонизации имен авторов: "Лев Толстой", "Толстой Лев", "Л. Н. Толстой" и "Leo Tolstoy"
+# сводятся к одной сигнатуре "каноническая фамилия + первая буква имени". Решения сохраняются
+# в таблице псевдонимов SQLite и переиспользуются при следующих запусках.
+
+import re
+import unicodedata
+from collections import Counter
+from functools import lru_cache
+from metadata_cache import open_database
+
+# Версия правил свертки: таблица, построенная по другим правилам, пересобирается
+FOLD_VERSION = 2
+
+# Транслитерация кириллицы; результат дополнительно сводится правилами FOLD_RULES
+TRANSLIT = str.maketrans({
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ж': 'zh', 'з': 'z', 'и': 'i', 'й': 'i',
+    'к': 'k', 'л': 'l', 'м': 'm', 'н': 'n', 'о': 'o', 'п': 'p', 'р': 'r', 'с': 's', 'т': 't', 'у': 'u',
+    'ф': 'f', 'х': 'kh', 'ц': 'ts', 'ч': 'ch', 'ш': 'sh', 'щ': 'shch', 'ъ': '', 'ы': 'y', 'ь': '', 'э': 'e',
+    'ю': 'yu', 'я': 'ya', 'і': 'i', 'ї': 'i', 'є': 'e', 'ґ': 'g', 'ў': 'u',
+})
+
+# "е" после гласной или мягкого знака читается как "йе" и так же пишется латиницей: Достоевский - Dostoyevsky
+IOTATED = re.compile(r'(?<=[аеиоуыэюяьъ])е')
+
+# Правила, сводящие разные латинские написания к одному: Tolstoy/Tolstoi, Chekhov/Tchekhov.
+# Правила только заменяют буквы и не удаляют их: удаление гласных и удвоенных букв
+# склеивало разные фамилии (Маяковский/Маковский, Леев/Лев).
+FOLD_RULES = [
+    (re.compile(r'shch|sch'), 'sh'), (re.compile(r'tch'), 'ch'), (re.compile(r'kh'), 'h'), (re.compile(r'ck'), 'k'),
+    (re.compile(r'ph'), 'f'), (re.compile(r'w'), 'v'), (re.compile(r'x'), 'ks'), (re.compile(r'tz'), 'ts'),
+    (re.compile(r'[jy]'), 'i'),
+    (re.compile(r'ii$'), 'i'),  # Окончание "-ий": Достоевский/Dostoevsky
+]
+
+PATRONYMIC = re.compile(r'(vich|vna|ichna)$')  # Отчество (по свертке): Николаевич, Ильинична
+NOT_LETTER = re.compile(r"[^\w-]|_")
+SUBSTITUTIONS = [{'v', 'f'}, {'e', 'i'}]  # Замены букв, допустимые при нечетком сравнении фамилий
+
+
+@lru_cache(maxsize=None)
+def skeleton(token):
+    # Сводит слово имени к упрощенной латинской записи: регистр, форма Юникода, ё/е, транслитерация, диакритика.
+    # Результат кэшируется: имена и фамилии повторяются в тысячах ключей.
+    # Принимает строку `token`.
+    # Возвращает строку, например "Толстой" и "Tolstoy" -> "tolstoi".
+
+    text = NOT_LETTER.sub('', unicodedata.normalize('NFC', token).casefold().replace('ё', 'е'))
+    text = IOTATED.sub('йе', text).translate(TRANSLIT)
+    text = ''.join(char for char in unicodedata.normalize('NFKD', text) if not unicodedata.combining(char))
+    for pattern, replacement in FOLD_RULES:
+        text = pattern.sub(replacement, text)
+    return text
+
+
+def name_initial(word):
+    # Возвращает первую букву имени в упрощенной записи без начальной йотации: Yevgeny/Евгений -> "e",
+    # Юрий/Yuri/"Ю." -> "u". Для автора без имени возвращает пустую строку.
+
+    if word[:1] == 'i' and word[1:2] in ('a', 'e', 'o', 'u'):
+        return word[1]
+    return word[:1]
+
+
+# Распространенные имена: при равном счете слово из этого списка считается именем, а не фамилией
+GIVEN_NAMES = {skeleton(name) for name in '''
+    Александр Алексей Анатолий Андрей Антон Аркадий Борис Вадим Валентин Валерий Василий Виктор Виталий Владимир
+    Владислав Всеволод Вячеслав Геннадий Георгий Глеб Григорий Даниил Денис Дмитрий Евгений Егор Иван Игорь Илья
+    Кирилл Константин Лев Леонид Максим Михаил Никита Николай Олег Павел Петр Роман Святослав Семен Сергей
+    Станислав Степан Тимофей Федор Юрий Яков Ярослав
+    Александра Алла Анастасия Анна Антонина Валентина Вера Виктория Галина Дарья Евгения Екатерина Елена Елизавета
+    Зинаида Ирина Лариса Лидия Любовь Людмила Маргарита Марина Мария Надежда Наталья Нина Ольга Полина Светлана
+    Софья Татьяна Юлия
+    Alexander Alexei Alexey Andrew Anton Arthur Boris Charles David Edgar Fyodor George Henry Isaac Ivan Jack James
+    John Joseph Leo Leon Mark Michael Mikhail Nikolai Oscar Paul Peter Richard Robert Sergei Stephen Thomas Victor
+    Vladimir William Yuri
+    Agatha Alice Anna Anne Catherine Elizabeth Emily Helen Jane Margaret Mary Olga Sarah Virginia
+'''.split()}
+
+
+def parse_name(name):
+    # Разбирает имя автора на полные слова и инициалы (в упрощенной записи skeleton).
+    # Отчество отбрасывается, если кроме него есть хотя бы два полных слова.
+    # Принимает строку `name`, например "Л.Н. Толстой".
+    # Возвращает кортеж (полные слова, инициалы).
+
+    words, initials = [], []
+    for token in name.replace('.', ' ').split():
+        folded = skeleton(token)
+        if folded:
+            (initials if len(token) == 1 else words).append(folded)
+    if len(words) >= 3:
+        words = [word for word in words if not PATRONYMIC.search(word)] or words
+    return tuple(words), tuple(initials)
+
+
+def deletions(word):
+    # Возвращает слово и все его варианты без одной буквы - ключи блоков для нечеткого сравнения.
+    # Два слова на расстоянии одной правки (вставка, удаление, замена) имеют общий ключ.
+
+    return {word} | {word[:position] + word[position + 1:] for position in range(len(word))}
+
+
+def spelling_variant(first, second):
+    # Проверяет, что слова различаются одной правкой, типичной для разных транслитераций:
+    # вставкой или удалением "e", "i", "h" (Turgeniev/Turgenev, Dostoevsky/Достоевский),
+    # удвоением согласной (Mandelshtam/Mandelstamm) или заменой v/f, e/i.
+
+    if len(first) > len(second):
+        first, second = second, first
+    if len(second) - len(first) > 1:
+        return False
+    start = 0
+    while start < len(first) and first[start] == second[start]:
+        start += 1
+    if len(first) == len(second):
+        return first[start + 1:] == second[start + 1:] and {first[start], second[start]} in SUBSTITUTIONS
+    inserted = second[start]
+    doubled = inserted not in 'aeiou' and inserted in second[start - 1:start] + second[start + 1:start + 2]
+    return first[start:] == second[start + 1:] and (inserted in 'eih' or doubled)
+
+
+def similar_surnames(first, second):
+    # Проверяет, что упрощенные фамилии - написания одной фамилии: длина от 5 букв и одна правка
+    # из spelling_variant (мужская и женская формы, Петров/Петрова, так не совпадают).
+
+    return min(len(first), len(second)) >= 5 and first != second and spelling_variant(first, second)
+
+
+def choose_surname(words, score):
+    # Выбирает фамилию среди полных слов имени. Слово из GIVEN_NAMES фамилией выбирается последним,
+    # дальше решает счет `score` ("сколько раз слово было фамилией минус сколько раз именем"),
+    # при равенстве - последнее слово.
+    # Принимает кортеж `words` и функцию `score`.
+    # Возвращает кортеж (фамилия, решение уверенное).
+
+    if len(words) == 1:
+        return words[0], True
+    ranked = sorted(((word not in GIVEN_NAMES, score(word), position) for position, word in enumerate(words)),
+                    reverse=True)
+    return words[ranked[0][2]], ranked[0][:2] != ranked[1][:2]
+
+
+class AuthorAliases:
+    # Таблица псевдонимов авторов: имя автора -> фамилия и имя (упрощенная запись),
+    # фамилия -> каноническая фамилия. Сравниваются только фамилии внутри одного блока
+    # (первая буква имени + вариант фамилии без одной буквы), без сравнения всех пар.
+    # Имена, порядок слов в которых определен только по положению (`sure` = 0), пересматриваются
+    # при следующих вызовах learn, когда накопится статистика.
+
+    def __init__(self, db_path, read_only=False):
+        # Открывает (или создает) таблицу псевдонимов и загружает ее в память.
+        # Принимает `db_path` - путь к файлу SQLite и `read_only` - не сохранять новые решения (для --dry-run):
+        # они действуют только до закрытия таблицы; отсутствующая база не создается.
+
+        self.read_only = read_only
+        self.connection = open_database(db_path, read_only)
+        if self.connection.execute('PRAGMA user_version').fetchone()[0] != FOLD_VERSION:
+            with self.connection:  # Таблица построена по прежним правилам свертки (при `read_only` - только копия)
+                self.connection.execute('DROP TABLE IF EXISTS names')
+                self.connection.execute('DROP TABLE IF EXISTS surnames')
+                self.connection.execute(f'PRAGMA user_version = {FOLD_VERSION}')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS names (name TEXT PRIMARY KEY, surname TEXT, given TEXT, sure INTEGER)')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS surnames (surname TEXT PRIMARY KEY, canonical TEXT)')
+        self.names = {}  # Имя автора -> (фамилия, имя)
+        self.unsure = {}  # Слово -> имена с этим словом, решение по которым будет пересмотрено
+        self.surname_counts = Counter()  # Сколько раз слово выбрано фамилией
+        self.given_counts = Counter()  # Сколько раз слово выбрано именем
+        self.initials_of = {}  # Фамилия -> первые буквы имен ее авторов
+        for name, surname, given, sure in self.connection.execute('SELECT * FROM names'):
+            self.remember(name, surname, given)
+            if not sure:
+                self.mark_unsure(name)
+        self.surnames = dict(self.connection.execute('SELECT * FROM surnames'))
+        self.blocks = None  # Ключ блока -> множество фамилий, строится при первой нечеткой проверке
+
+    def remember(self, name, surname, given):
+        # Запоминает решение по имени и учитывает его в счетчиках (счетчики ведутся по мере решений,
+        # чтобы пакет из нескольких книг не пересчитывал всю библиотеку).
+
+        self.names[name] = (surname, given)
+        self.surname_counts[surname] += 1
+        if len(given) > 1:
+            self.given_counts[given] += 1
+        self.initials_of.setdefault(surname, set()).add(name_initial(given))
+
+    def mark_unsure(self, name):
+        # Запоминает имя для пересмотра, когда в новых именах встретятся его слова.
+
+        for word in parse_name(name)[0]:
+            self.unsure.setdefault(word, set()).add(name)
+
+    def forget(self, name):
+        # Убирает прежнее решение по имени из счетчиков.
+
+        surname, given = self.names.pop(name)
+        self.surname_counts[surname] -= 1
+        if len(given) > 1:
+            self.given_counts[given] -= 1
+
+    def learn(self, keys):
+        # Разбирает новые имена авторов из ключей словаря авторов и сохраняет решения в таблице.
+        # Вместе с новыми именами пересматриваются имена, решенные прежде только по положению слов,
+        # если в новых именах встретились их слова (по другим словам статистика не изменилась).
+        # Принимает `keys` - ключи словаря авторов вида "Имя Фамилия, Имя Фамилия".
+        # Возвращает число новых и пересмотренных имен.
+
+        new_names = {}
+        for key in keys:
+            for name in key.split(', '):
+                if name not in self.names and name not in new_names:
+                    new_names[name] = parse_name(name)
+        if not new_names:
+            return 0
+        revisit = set()
+        for words, initials in list(new_names.values()):
+            for word in words:
+                revisit.update(self.unsure.pop(word, ()))
+        for name in revisit:
+            new_names[name] = parse_name(name)
+            self.forget(name)
+        for word in {word for name in revisit for word in new_names[name][0]}:
+            self.unsure.get(word, set()).difference_update(revisit)
+
+        # Пока решения пакета не приняты, его слова учитываются по умолчанию: последнее - фамилия
+        batch_surnames, batch_given = Counter(), Counter()
+        for words, initials in new_names.values():
+            if words:
+                batch_surnames[words[-1]] += 1
+                batch_given.update(words[:-1])
+
+        def score(word):
+            return (self.surname_counts[word] + batch_surnames[word]) - (self.given_counts[word] + batch_given[word])
+
+        rows = []
+        for name, (words, initials) in new_names.items():
+            if words:
+                batch_surnames[words[-1]] -= 1  # Имя не должно голосовать само за себя
+                batch_given.subtract(words[:-1])
+                surname, sure = choose_surname(words, score)
+                batch_surnames[words[-1]] += 1
+                batch_given.update(words[:-1])
+                others = [word for word in words if word != surname] + list(initials)
+            else:
+                sure = True
+                surname, others = (initials[-1], initials[:-1]) if initials else (name, ())
+            given = others[0] if others else ''
+            self.remember(name, surname, given)
+            if not sure:
+                self.mark_unsure(name)
+            rows.append((name, surname, given, int(sure)))
+
+        new_surnames = Counter(self.names[name][0] for name in new_names)
+        new_surnames = [surname for surname, count in new_surnames.most_common() if surname not in self.surnames]
+        aliases = []
+        for surname in new_surnames:  # Самое частое написание становится каноническим
+            self.surnames[surname] = self.match_surname(surname, self.initials_of[surname])
+            aliases.append((surname, self.surnames[surname]))
+
+        if self.read_only:
+            return len(new_names)
+        with self.connection:
+            self.connection.executemany('INSERT OR REPLACE INTO names VALUES (?, ?, ?, ?)', rows)
+            self.connection.executemany('INSERT OR REPLACE INTO surnames VALUES (?, ?)', aliases)
+        return len(new_names)
+
+    def match_surname(self, surname, initials):
+        # Ищет известную фамилию - другое написание `surname` у автора с той же первой буквой имени.
+        # Принимает строку `surname` - упрощенная фамилия и множество `initials` - первые буквы имен ее авторов.
+        # Возвращает каноническую фамилию (саму `surname`, если похожих нет) и добавляет фамилию в блоки.
+
+        if self.blocks is None:
+            self.blocks = {}
+            for known in self.surnames:
+                self.add_to_blocks(known, self.initials_of.get(known, ()))
+
+        candidates = set()
+        for initial in initials:
+            for variant in deletions(surname):
+                candidates.update(self.blocks.get((initial, variant), ()))
+        matches = sorted(self.surnames[candidate] for candidate in candidates
+                         if candidate != surname and similar_surnames(candidate, surname))
+        self.add_to_blocks(surname, initials)
+        return matches[0] if matches else surname
+
+    def add_to_blocks(self, surname, initials):
+        # Добавляет фамилию в блоки для каждой первой буквы имени ее авторов.
+
+        for initial in initials:
+            for variant in deletions(surname):
+                self.blocks.setdefault((initial, variant), set()).add(surname)
+
+    def signature(self, key):
+        # Формирует сигнатуру ключа авторов - множество пар "каноническая фамилия, первая буква имени"
+        # (замена main.author_signature при объединении авторов): Лев и Алексей Толстые не объединяются,
+        # а фамилия без имени попадает к автору этой фамилии, только если других авторов с ней нет.
+        # Принимает строку `key` - ключ словаря авторов.
+        # Возвращает frozenset.
+
+        names = key.split(', ')
+        if any(name not in self.names for name in names):
+            self.learn([key])
+        pairs = []
+        for name in names:
+            surname, given = self.names[name]
+            initial = name_initial(given)
+            if not initial:
+                # Фамилия без имени ("Толстой") объединяется с автором этой фамилии, если он единственный
+                known = self.initials_of[surname] - {''}
+                if len(known) == 1:
+                    initial, = known
+            pairs.append((self.surnames[surname], initial))
+        return frozenset(pairs)
+
+    def close(self):
+        # Закрывает базу.
+
+        self.connection.close()
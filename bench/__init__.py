@@ -0,0 +1,2 @@
+# Пакет для измерения производительности: генератор синтетической библиотеки и запуск замеров по фазам.
+# Запуск: python -m bench.run --sizes 1000 10000 (из корня репозитория).
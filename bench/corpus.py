@@ -0,0 +1,131 @@
+# Детерминированный генератор синтетической библиотеки EPUB и FB2.
+
+import base64
+import io
+import itertools
+import os
+import random
+import zipfile
+
+FIRST_NAMES = ['Лев', 'Фёдор', 'Антон', 'Иван', 'Михаил', 'Анна', 'Марина', 'Александр', 'Николай', 'Борис',
+               'Leo', 'Anton', 'Ivan', 'Anna', 'Boris']
+SYLLABLES = ['то', 'ев', 'ски', 'ой', 'ов', 'ин', 'ра', 'ко', 'ма', 'ле', 'ну', 'шев', 'гин', 'тур', 'ба']
+WORDS = ['война', 'мир', 'сад', 'дом', 'ночь', 'море', 'город', 'повесть', 'песня', 'река', 'лес', 'дорога']
+
+FB2_NS = 'http://www.gribuser.ru/xml/fictionbook/2.0'
+
+
+def generate_corpus(folder, count, seed=0, books_per_author=5, shared_surname_rate=0.2, epub_rate=0.5,
+                    body_size=20000, binary_size=50000, malformed_rate=0.01, duplicate_rate=0.0,
+                    near_duplicate_rate=0.0, fb2_zip_rate=0.0):
+    # Создает `count` файлов книг в папке `folder`. Одинаковые параметры всегда дают одинаковый набор файлов.
+    # Принимает `seed` - зерно генератора, `books_per_author` - среднее число книг на автора,
+    # `shared_surname_rate` - доля авторов с общей фамилией, `epub_rate` - доля EPUB,
+    # `body_size` и `binary_size` - размер текста и вложенного изображения в байтах,
+    # `malformed_rate` - доля поврежденных файлов, `duplicate_rate` - доля побайтных копий,
+    # `near_duplicate_rate` - доля копий того же размера с одним измененным байтом,
+    # `fb2_zip_rate` - доля FB2, упакованных в архив FB2.ZIP.
+    # Возвращает список путей к созданным файлам.
+
+    rng = random.Random(seed)
+    os.makedirs(folder, exist_ok=True)
+    authors = generate_authors(rng, max(1, count // books_per_author), shared_surname_rate)
+    weights = list(itertools.accumulate(1 / (rank + 1) for rank in range(len(authors))))  # Распределение Ципфа
+    binary = base64.b64encode(rng.randbytes(binary_size * 3 // 4)).decode('ascii')
+    paths = []
+
+    for number in range(count):
+        roll = rng.random()
+        if paths and roll < duplicate_rate:
+            content, extension = copy_content(rng, paths)
+        elif paths and roll < duplicate_rate + near_duplicate_rate:
+            content, extension = copy_content(rng, paths)
+            middle = len(content) // 2
+            content = content[:middle] + bytes([content[middle] ^ 1]) + content[middle + 1:]
+        elif roll < duplicate_rate + near_duplicate_rate + malformed_rate:
+            content, extension = b'<FictionBook><description><title-info>' + rng.randbytes(64), 'fb2'
+        else:
+            book_authors = rng.choices(authors, cum_weights=weights, k=1 if rng.random() < 0.9 else 2)
+            title = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(1, 4))).capitalize() + f' {number}'
+            body = ' '.join(rng.choice(WORDS) for _ in range(body_size // 6))
+            if rng.random() < epub_rate:
+                content, extension = make_epub(title, book_authors, body, binary), 'epub'
+            else:
+                encoding = 'utf-8' if rng.random() < 0.8 else 'windows-1251'
+                content, extension = make_fb2(title, book_authors, body, binary, encoding), 'fb2'
+                if rng.random() < fb2_zip_rate:
+                    content, extension = make_fb2_zip(content), 'fb2.zip'
+        path = os.path.join(folder, f'book{number:07d}.{extension}')
+        with open(path, 'wb') as file:
+            file.write(content)
+        paths.append(path)
+    return paths
+
+
+def generate_authors(rng, count, shared_surname_rate):
+    # Создает список авторов (имя, фамилия); часть авторов получает уже использованные фамилии.
+    # Принимает `rng` - генератор, `count` - число авторов и `shared_surname_rate` - доля общих фамилий.
+
+    authors = []
+    for _ in range(count):
+        if authors and rng.random() < shared_surname_rate:
+            surname = rng.choice(authors)[1]
+        else:
+            surname = ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))).capitalize()
+        authors.append((rng.choice(FIRST_NAMES), surname))
+    return authors
+
+
+def make_fb2(title, authors, body, binary, encoding='utf-8'):
+    # Формирует содержимое FB2 с заголовком, текстом и вложением <binary>.
+    # Возвращает байтовую строку в кодировке `encoding`.
+
+    author_xml = ''.join(f'<author><first-name>{first}</first-name><last-name>{last}</last-name></author>'
+                         for first, last in authors)
+    text = (f'<?xml version="1.0" encoding="{encoding}"?>\n'
+            f'<FictionBook xmlns="{FB2_NS}" xmlns:l="http://www.w3.org/1999/xlink">'
+            f'<description><title-info><genre>prose</genre>{author_xml}<book-title>{title}</book-title>'
+            f'<lang>ru</lang></title-info></description>'
+            f'<body><section><p>{body}</p></section></body>'
+            f'<binary id="cover.jpg" content-type="image/jpeg">{binary}</binary></FictionBook>')
+    return text.encode(encoding, errors='replace')
+
+
+def make_fb2_zip(content):
+    # Упаковывает содержимое FB2 в архив FB2.ZIP.
+    # Возвращает байтовую строку - zip-архив.
+
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('book.fb2', content)
+    return buffer.getvalue()
+
+
+def make_epub(title, authors, body, binary):
+    # Формирует содержимое EPUB: container.xml, OPF с метаданными, глава и изображение.
+    # Возвращает байтовую строку - zip-архив.
+
+    creators = ''.join(f'<dc:creator>{first} {last}</dc:creator>' for first, last in authors)
+    opf = (f'<?xml version="1.0" encoding="utf-8"?>'
+           f'<package xmlns="http://www.idpf.org/2007/opf" xmlns:dc="http://purl.org/dc/elements/1.1/">'
+           f'<metadata><dc:title>{title}</dc:title>{creators}<dc:language>ru</dc:language></metadata>'
+           f'</package>')
+    container = ('<?xml version="1.0"?><container xmlns="urn:oasis:names:tc:opendocument:xmlns:container">'
+                 '<rootfiles><rootfile full-path="OEBPS/content.opf"/></rootfiles></container>')
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        archive.writestr('mimetype', 'application/epub+zip')
+        archive.writestr('META-INF/container.xml', container)
+        archive.writestr('OEBPS/content.opf', opf)
+        archive.writestr('OEBPS/chapter.xhtml', f'<html><body><p>{body}</p></body></html>',
+                         compress_type=zipfile.ZIP_DEFLATED)
+        archive.writestr('OEBPS/cover.jpg', base64.b64decode(binary))
+    return buffer.getvalue()
+
+
+def copy_content(rng, paths):
+    # Возвращает содержимое и расширение случайного уже созданного файла.
+
+    path = rng.choice(paths)
+    with open(path, 'rb') as file:
+        return file.read(), os.path.basename(path).split('.', 1)[1]
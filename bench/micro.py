@@ -0,0 +1,402 @@
+# Точечные замеры отдельных оптимизаций в сравнении с прежними реализациями.
+# Пример: python -m bench.micro fb2 merge aliases organize plan asyncfs dedupe search
+
+import argparse
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from lxml import etree
+
+from async_fs import AsyncFS
+from author_names import AuthorAliases, TRANSLIT, name_initial, skeleton
+from bench.corpus import generate_corpus, generate_authors, WORDS
+from config import xpath_values, namespace
+from dedupe import Deduplicator
+from library_index import LibraryIndex
+from main import (read_metadata_from_file, compare_and_merge_keys, organize_books_by_author,
+                  extract_metadata, apply_metadata, plan_books_by_author)
+from metadata_cache import MetadataCache
+from move_plan import MovePlan
+
+try:
+    import resource
+except ImportError:  # Windows: пиковая память не измеряется
+    resource = None
+
+
+def parse_fb2_full(file):
+    # Прежнее чтение FB2: разбор всего файла (huge_tree - чтобы не упасть на текстовых узлах больше 10 МБ).
+
+    tree = etree.parse(file, etree.XMLParser(huge_tree=True))
+    return tree.xpath(xpath_values['fb2']['title'], namespaces=namespace)
+
+
+def parse_fb2_header(file):
+    # Текущее чтение FB2: только блок <description>.
+
+    tree = read_metadata_from_file(file, 'fb2')
+    return tree.xpath(xpath_values['fb2']['title'], namespaces=namespace)
+
+
+def measure_reader(reader, files):
+    # Выполняется в отдельном процессе, чтобы пиковая память не зависела от других замеров.
+    # Возвращает (среднее время на файл в секундах, пиковая память процесса в МБ).
+
+    started = time.perf_counter()
+    for file in files:
+        reader(file)
+    per_file = (time.perf_counter() - started) / len(files)
+    return per_file, peak_rss()
+
+
+def peak_rss():
+    # Возвращает пиковую память текущего процесса в МБ.
+    # В Linux читается VmHWM: ru_maxrss наследуется через fork/exec и может показать пик родителя.
+
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 if resource else float('nan')
+
+
+def bench_fb2(count=10, binary_size=8 * 1024 * 1024):
+    # Сравнивает полное и потоковое чтение больших FB2 с вложениями.
+
+    with tempfile.TemporaryDirectory() as folder:
+        files = generate_corpus(folder, count, epub_rate=0, malformed_rate=0, body_size=2 * 1024 * 1024,
+                                binary_size=binary_size)
+        size = sum(os.path.getsize(file) for file in files) / count / 1024 / 1024
+        print(f'FB2 metadata, {count} files of {size:.1f} MB:')
+        for name, reader in [('etree.parse', parse_fb2_full), ('read_fb2_header', parse_fb2_header)]:
+            # Новый процесс без наследования памяти родителя
+            with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+                per_file, peak = executor.submit(measure_reader, reader, files).result()
+            print(f'  {name:<16} {per_file * 1000:9.2f} ms/file  peak RSS {peak:8.1f} MB')
+
+
+def compare_and_merge_keys_quadratic(author_dict):
+    # Прежняя реализация объединения авторов (квадратичная), для сверки результатов.
+
+    merged_dict = {}
+    while author_dict:
+        key1, books1 = author_dict.popitem()
+        author_last_names = set(author.split()[-1] for author in key1.split(', '))
+        matching_keys = [key2 for key2 in author_dict.keys() if set(author.split()[-1] for author in key2.split(', '))
+                         == author_last_names]
+        if matching_keys:
+            merged_books = books1.union(*[author_dict[key] for key in matching_keys])
+            for key in matching_keys:
+                del author_dict[key]
+            merged_dict[key1] = merged_books
+        else:
+            merged_dict[key1] = books1
+    return merged_dict
+
+
+def make_author_dict(count, seed=0):
+    # Создает словарь из `count` ключей авторов с общими фамилиями.
+
+    rng = random.Random(seed)
+    surnames = [f'Surname{number}' for number in range(max(1, count // 3))]
+    author_dict = {}
+    for number in range(count):
+        key = ', '.join(f'Name{rng.randrange(50)} {rng.choice(surnames)}' for _ in range(rng.choice([1, 1, 1, 2])))
+        author_dict.setdefault(key, set()).add(f'book{number}')
+    return author_dict
+
+
+def bench_merge(sizes=(1000, 10000, 100000), quadratic_limit=10000):
+    # Замеряет объединение авторов и сверяет результат с прежней реализацией.
+
+    print('compare_and_merge_keys:')
+    for size in sizes:
+        author_dict = make_author_dict(size)
+        started = time.perf_counter()
+        merged = compare_and_merge_keys({key: set(books) for key, books in author_dict.items()})
+        seconds = time.perf_counter() - started
+        line = f'  {len(author_dict):>7} keys  index {seconds:9.4f} s'
+        if size <= quadratic_limit:
+            started = time.perf_counter()
+            expected = compare_and_merge_keys_quadratic({key: set(books) for key, books in author_dict.items()})
+            line += f'  quadratic {time.perf_counter() - started:9.4f} s'
+            same = list(expected.items()) == list(merged.items())
+            line += '  same result' if same else '  DIFFERENT RESULT'
+        print(line)
+        if size <= quadratic_limit and not same:
+            raise AssertionError(f'compare_and_merge_keys differs from the quadratic version on {size} keys')
+
+
+def make_author_variants(count, seed=0):
+    # Создает `count` ключей авторов, записанных по-разному: "Имя Фамилия", "Фамилия Имя", "И. Фамилия"
+    # и латиницей. Автор определяется фамилией и первой буквой имени.
+    # Возвращает кортеж (словарь авторов, словарь "ключ -> множество авторов, записанных этим ключом").
+
+    rng = random.Random(seed)
+    authors = generate_authors(rng, max(1, count // 2), 0.2)
+    spellings = [lambda first, last: f'{first} {last}', lambda first, last: f'{last} {first}',
+                 lambda first, last: f'{first[0]}. {last}',
+                 lambda first, last: f'{first.lower().translate(TRANSLIT).capitalize()} '
+                                     f'{last.lower().translate(TRANSLIT).capitalize()}']
+    author_dict, truth = {}, {}
+    while len(author_dict) < count:
+        first, last = rng.choice(authors)
+        key = rng.choice(spellings)(first, last)
+        author_dict.setdefault(key, set()).add(f'book{len(author_dict)}')
+        truth.setdefault(key, set()).add((last, name_initial(skeleton(first))))
+    return author_dict, truth
+
+
+def bench_aliases(count=200000):
+    # Замеряет канонизацию имен авторов: первый запуск (все имена новые) и повторный (таблица псевдонимов
+    # загружается из базы). Сравнивает число групп с числом авторов и с объединением по последнему слову
+    # и считает группы, в которые попали разные авторы.
+
+    author_dict, truth = make_author_variants(count)
+    authors = set().union(*truth.values())
+    baseline = compare_and_merge_keys({key: set(books) for key, books in author_dict.items()})
+    print(f'Author aliases, {len(author_dict)} keys, {len(authors)} authors:')
+    print(f'  last-word signature      {len(baseline):>7} groups')
+    with tempfile.TemporaryDirectory() as folder:
+        for run in ['first run', 'second run']:
+            copy = {key: set(books) for key, books in author_dict.items()}
+            started = time.perf_counter()
+            aliases = AuthorAliases(os.path.join(folder, 'aliases.sqlite'))
+            aliases.learn(copy)
+            merged = compare_and_merge_keys(copy, aliases.signature)
+            seconds = time.perf_counter() - started
+            groups = {}
+            for key in author_dict:
+                groups.setdefault(aliases.signature(key), set()).update(truth[key])
+            aliases.close()
+            mixed = sum(len(group) > 1 for group in groups.values())
+            print(f'  aliases, {run:<14} {len(merged):>7} groups  {mixed} mixed  {seconds:8.2f} s')
+
+
+class SyscallCounter:
+    # Подменяет функции os, через которые идут обращения к файловой системе, и считает вызовы.
+
+    NAMES = ['scandir', 'listdir', 'stat', 'lstat', 'rename', 'replace']
+
+    def __init__(self):
+        self.counts = dict.fromkeys(self.NAMES, 0)
+        self.originals = {}
+
+    def __enter__(self):
+        for name in self.NAMES:
+            original = self.originals[name] = getattr(os, name)
+
+            def counted(*args, _name=name, _original=original, **kwargs):
+                self.counts[_name] += 1
+                return _original(*args, **kwargs)
+            setattr(os, name, counted)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        for name, original in self.originals.items():
+            setattr(os, name, original)
+        return False
+
+
+def organize_books_by_author_walk(merged_dict, base_folder='books'):
+    # Прежняя реализация: поиск каждой книги обходом всей папки.
+
+    for authors, books in merged_dict.items():
+        author_folder = os.path.join(base_folder, authors)
+        os.makedirs(author_folder, exist_ok=True)
+        for book in books:
+            source_path = next((os.path.join(root, book) for root, dirs, files in os.walk('books') if book in files),
+                               None)  # Обход всей папки для каждой книги
+            destination_path = os.path.join(author_folder, book)
+            if source_path and source_path != destination_path:
+                shutil.move(source_path, destination_path)
+
+
+def bench_organize(count=2000):
+    # Считает обращения к файловой системе на книгу при раскладке по папкам авторов.
+
+    print(f'organize_books_by_author, {count} books:')
+    for name, organize in [('os.walk per book', organize_books_by_author_walk),
+                           ('path index', organize_books_by_author)]:
+        previous_folder = os.getcwd()
+        with tempfile.TemporaryDirectory() as folder:
+            os.chdir(folder)
+            try:
+                files = generate_corpus('books', count, malformed_rate=0, body_size=100, binary_size=100)
+                merged = compare_and_merge_keys(rename_into_books(filter(None, map(extract_metadata, files))))
+                with SyscallCounter() as counter:
+                    started = time.perf_counter()
+                    organize(merged)
+                    seconds = time.perf_counter() - started
+            finally:
+                os.chdir(previous_folder)
+        per_book = ', '.join(f'{key} {value / count:.1f}' for key, value in counter.counts.items())
+        print(f'  {name:<18} {seconds:8.3f} s  per book: {per_book}')
+
+
+def rename_into_books(records, taken=None):
+    # Прежняя первая стадия раскладки: каждая книга сразу переименовывается в папку 'books'.
+    # Возвращает словарь авторов.
+
+    author_dict = {}
+    for record in records:
+        os.rename(record[0], os.path.join('books', apply_metadata(record, author_dict, taken)))
+    return author_dict
+
+
+def file_books_in_two_steps(records):
+    # Прежняя раскладка: переименование в папку 'books', затем перемещение в папку автора.
+
+    organize_books_by_author(compare_and_merge_keys(rename_into_books(records, set())))
+
+
+def file_books_by_plan(records, journal_path=None):
+    # Текущая раскладка: план перемещений сразу в папки авторов, выполнение пакетами.
+
+    author_dict = {}
+    taken = set()
+    sources = {apply_metadata(record, author_dict, taken): record[0] for record in records}
+    plan = MovePlan()
+    plan_books_by_author(compare_and_merge_keys(author_dict), plan, sources)
+    plan.execute(journal_path)
+
+
+def bench_plan(count=2000):
+    # Сравнивает число перемещений и время раскладки новых книг: в два шага и по плану (с журналом и без).
+
+    print(f'Filing {count} new books:')
+    for name, file_books in [('two steps', file_books_in_two_steps), ('plan', file_books_by_plan),
+                             ('plan + journal', partial(file_books_by_plan, journal_path='books/.journal'))]:
+        previous_folder = os.getcwd()
+        with tempfile.TemporaryDirectory() as folder:
+            os.chdir(folder)
+            try:
+                files = generate_corpus('inbox', count, malformed_rate=0, body_size=100, binary_size=100)
+                records = list(filter(None, map(extract_metadata, files)))
+                os.makedirs('books')
+                with SyscallCounter() as counter:
+                    started = time.perf_counter()
+                    file_books(records)
+                    seconds = time.perf_counter() - started
+            finally:
+                os.chdir(previous_folder)
+        moves = counter.counts['rename'] + counter.counts['replace']
+        print(f'  {name:<16} {seconds:8.3f} s  moves per book: {moves / count:.1f}')
+
+
+def bench_asyncfs(authors=100, books_per_author=4, latency=0.005, levels=(1, 4, 16, 64)):
+    # Замеряет асинхронный режим на локальной папке с искусственной задержкой `latency` каждого обращения,
+    # имитирующей сетевой диск. Режим с одним потоком соответствует последовательным обращениям.
+
+    print(f'AsyncFS, {authors} authors x {books_per_author} books, {latency * 1000:.0f} ms per call:')
+    with tempfile.TemporaryDirectory() as folder:
+        library = os.path.join(folder, 'books')
+        inbox = os.path.join(folder, 'inbox')
+        for author in range(authors):
+            os.makedirs(os.path.join(library, f'Author {author}', 'Empty'))
+            for book in range(books_per_author):
+                open(os.path.join(library, f'Author {author}', f'book{book}.fb2'), 'w').close()
+        paths = [os.path.join(root, file) for root, folders, files in os.walk(library) for file in files]
+        for concurrency in levels:
+            fs = AsyncFS(concurrency, latency)
+            timings = {}
+            started = time.perf_counter()
+            author_dict = fs.run(fs.create_author_dict(library))
+            timings['create_author_dict'] = time.perf_counter() - started
+            started = time.perf_counter()
+            fs.run(fs.existing_files(paths))
+            timings['link checks'] = time.perf_counter() - started
+            plan = MovePlan()
+            for path in paths:
+                plan.add(path, os.path.join(inbox, os.path.basename(os.path.dirname(path)), os.path.basename(path)))
+            started = time.perf_counter()
+            plan.execute(fs=fs)
+            timings['moves'] = time.perf_counter() - started
+            started = time.perf_counter()
+            fs.run(fs.remove_empty_folders(library))
+            timings['remove_empty_folders'] = time.perf_counter() - started
+            fs.close()
+            library, inbox = inbox, library  # Следующий замер переносит книги обратно
+            for author in range(authors):
+                os.makedirs(os.path.join(library, f'Author {author}', 'Empty'), exist_ok=True)
+            paths = [os.path.join(root, file) for root, folders, files in os.walk(library) for file in files]
+            line = '  '.join(f'{name} {seconds:6.2f} s' for name, seconds in timings.items())
+            print(f'  concurrency {concurrency:>3}  {line}  ({len(author_dict)} authors)')
+
+
+def bench_dedupe(count=2000, duplicate_rate=0.1, near_duplicate_rate=0.3):
+    # Считает число прочитанных при поиске дубликатов байт на библиотеке с большим числом почти-копий.
+
+    with tempfile.TemporaryDirectory() as folder:
+        files = generate_corpus(folder, count, malformed_rate=0, duplicate_rate=duplicate_rate,
+                                near_duplicate_rate=near_duplicate_rate, binary_size=500000)
+        total = sum(os.path.getsize(file) for file in files)
+        cache = MetadataCache(os.path.join(folder, 'cache.sqlite'))
+        print(f'Duplicate detection, {count} files, {total / 1024 / 1024:.1f} MB:')
+        for run in ['first run', 'second run']:
+            deduplicator = Deduplicator(cache)
+            started = time.perf_counter()
+            duplicates = deduplicator.find_duplicates(files)
+            seconds = time.perf_counter() - started
+            print(f'  {run:<11} {len(duplicates)} duplicates, {deduplicator.bytes_hashed / 1024 / 1024:8.1f} MB hashed '
+                  f'({deduplicator.bytes_hashed / total:.1%} of corpus), {seconds:.3f} s')
+        cache.close()
+
+
+def bench_search(count=500000, queries=('война', 'мир дом', 'лес', 'ночь 4999', 'Leo')):
+    # Замеряет заполнение поискового индекса и время запросов на библиотеке из `count` книг (без файлов книг).
+
+    rng = random.Random(0)
+    authors = [f'{first} {last}' for first, last in generate_authors(rng, max(1, count // 5), 0.2)]
+    with tempfile.TemporaryDirectory() as folder:
+        index = LibraryIndex(os.path.join(folder, 'index.sqlite'))
+        merged, processed = {}, {}
+        for number in range(count):
+            author = rng.choice(authors)
+            title = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(1, 4))).capitalize() + f' {number}'
+            name = f'«{title}», {author}.fb2'
+            merged.setdefault(author, set()).add(name)
+            processed[name] = (name, 'fb2', title, [author], {'series': rng.choice(WORDS), 'year': 2000})
+        started = time.perf_counter()
+        index.update(merged, processed, {author: author for author in merged}, full=True)
+        print(f'Library index, {count} books: filled in {time.perf_counter() - started:.2f} s')
+        for query in queries:
+            started = time.perf_counter()
+            books = index.search(query)
+            print(f'  search {query!r:<14} {(time.perf_counter() - started) * 1000:8.2f} ms  {len(books)} results')
+        started = time.perf_counter()
+        books = index.books_by_author(authors[0])
+        print(f'  books_by_author      {(time.perf_counter() - started) * 1000:8.2f} ms  {len(books)} results')
+        index.close()
+
+
+BENCHMARKS = {'fb2': bench_fb2, 'merge': bench_merge, 'aliases': bench_aliases, 'organize': bench_organize, 'plan': bench_plan,
+              'asyncfs': bench_asyncfs, 'dedupe': bench_dedupe, 'search': bench_search}
+
+
+def main(argv=None):
+    # Запускает выбранные замеры (по умолчанию все).
+
+    parser = argparse.ArgumentParser(description='Точечные замеры оптимизаций Mylibrary.')
+    parser.add_argument('names', nargs='*', help=f"замеры для запуска: {', '.join(BENCHMARKS)} (по умолчанию все)")
+    args = parser.parse_args(argv)
+    unknown = set(args.names) - BENCHMARKS.keys()
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(sorted(unknown))}")
+    for name in args.names or BENCHMARKS:
+        BENCHMARKS[name]()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,145 @@
+# Замеры времени по фазам конвейера на синтетической библиотеке с сохранением результатов в JSON
+# и сравнением с сохраненным базовым замером.
+# Пример: python -m bench.run --sizes 1000 10000 --output bench.json --compare baseline.json
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+from bench.corpus import generate_corpus
+from config import ns_output
+from fb2_output import create_fb2_file
+from main import (extract_metadata, apply_metadata, compare_and_merge_keys, plan_books_by_author,
+                  remove_empty_folders)
+from move_plan import MovePlan
+
+PHASES = ['read_metadata_from_file', 'process_common', 'compare_and_merge_keys', 'plan_moves',
+          'organize_books_by_author', 'create_fb2_file', 'remove_empty_folders']
+
+
+def run_pipeline(count, seed=0, **corpus_options):
+    # Создает библиотеку из `count` книг во временной папке и замеряет время каждой фазы.
+    # Принимает `count` - число книг, `seed` - зерно генератора и параметры generate_corpus.
+    # Возвращает словарь "фаза -> время в секундах" и счетчики.
+
+    timings = {}
+    previous_folder = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix='mylibrary-bench-') as folder:
+        os.chdir(folder)  # Все пути конвейера относительны папки 'books'
+        try:
+            files = generate_corpus('books', count, seed=seed, **corpus_options)
+
+            started = time.perf_counter()
+            records = [record for record in map(extract_metadata, files) if record is not None]
+            timings['read_metadata_from_file'] = time.perf_counter() - started
+
+            author_dict = {}
+            taken = set()
+            sources = {}
+            started = time.perf_counter()
+            for record in records:
+                sources[apply_metadata(record, author_dict, taken)] = record[0]
+            timings['process_common'] = time.perf_counter() - started
+
+            started = time.perf_counter()
+            merged = compare_and_merge_keys(author_dict)
+            timings['compare_and_merge_keys'] = time.perf_counter() - started
+
+            started = time.perf_counter()
+            plan = MovePlan()
+            plan_books_by_author(merged, plan, sources)
+            timings['plan_moves'] = time.perf_counter() - started
+
+            started = time.perf_counter()
+            plan.execute('books/.move_journal.jsonl')
+            timings['organize_books_by_author'] = time.perf_counter() - started
+
+            started = time.perf_counter()
+            create_fb2_file(merged, ns_output, full=True)
+            timings['create_fb2_file'] = time.perf_counter() - started
+
+            started = time.perf_counter()
+            remove_empty_folders()
+            timings['remove_empty_folders'] = time.perf_counter() - started
+        finally:
+            os.chdir(previous_folder)
+
+    return {'seconds': timings, 'books': count, 'parsed': len(records), 'authors': len(merged)}
+
+
+def compare_results(current, baseline, threshold):
+    # Сравнивает замеры с базовыми и возвращает список регрессий.
+    # Фаза считается регрессией, если она медленнее базовой более чем в (1 + `threshold`) раз.
+    # Принимает словари `current` и `baseline` (формат результата main) и `threshold` - допуск.
+
+    regressions = []
+    for size, result in current['results'].items():
+        base = baseline['results'].get(size)
+        if base is None:
+            continue
+        for phase, seconds in result['seconds'].items():
+            base_seconds = base['seconds'].get(phase)
+            if base_seconds and seconds > base_seconds * (1 + threshold) and seconds - base_seconds > 0.01:
+                regressions.append((size, phase, base_seconds, seconds))
+    return regressions
+
+
+def parse_args(argv=None):
+    # Разбирает аргументы командной строки.
+
+    parser = argparse.ArgumentParser(description='Замеры производительности Mylibrary по фазам.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000],
+                        help='размеры библиотеки в книгах')
+    parser.add_argument('--seed', type=int, default=0, help='зерно генератора библиотеки')
+    parser.add_argument('--body-size', type=int, default=20000, help='размер текста книги в байтах')
+    parser.add_argument('--binary-size', type=int, default=50000, help='размер вложенного изображения в байтах')
+    parser.add_argument('--books-per-author', type=int, default=5, help='среднее число книг на автора')
+    parser.add_argument('--shared-surname-rate', type=float, default=0.2, help='доля авторов с общей фамилией')
+    parser.add_argument('--malformed-rate', type=float, default=0.01, help='доля поврежденных файлов')
+    parser.add_argument('--output', help='файл для сохранения результатов в JSON')
+    parser.add_argument('--compare', help='файл базового замера для поиска регрессий')
+    parser.add_argument('--threshold', type=float, default=0.2, help='допустимое замедление (0.2 = 20%%)')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    # Запускает замеры, печатает таблицу, сохраняет JSON и сравнивает с базовым замером.
+    # Возвращает код завершения: 1, если найдены регрессии.
+
+    args = parse_args(argv)
+    corpus_options = {'body_size': args.body_size, 'binary_size': args.binary_size,
+                      'books_per_author': args.books_per_author, 'shared_surname_rate': args.shared_surname_rate,
+                      'malformed_rate': args.malformed_rate}
+    report = {'python': platform.python_version(), 'platform': platform.platform(), 'seed': args.seed,
+              'corpus': corpus_options, 'results': {}}
+
+    for size in args.sizes:
+        result = run_pipeline(size, args.seed, **corpus_options)
+        report['results'][str(size)] = result
+        print(f"{size} books, {result['authors']} authors:")
+        for phase in PHASES:
+            seconds = result['seconds'][phase]
+            print(f"  {phase:<28} {seconds:9.3f} s  {size / seconds if seconds else 0:12.0f} books/s")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(report, file, indent=2, ensure_ascii=False)
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as file:
+            baseline = json.load(file)
+        regressions = compare_results(report, baseline, args.threshold)
+        for size, phase, base_seconds, seconds in regressions:
+            print(f"REGRESSION {size} books, {phase}: {base_seconds:.3f} s -> {seconds:.3f} s")
+        if regressions:
+            return 1
+        print('No regressions')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
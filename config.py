@@ -3,13 +3,23 @@ xpath_values = {
     'epub': {
         'container': 'n:rootfiles/n:rootfile/@full-path',
         'title': '/pkg:package/pkg:metadata/dc:title',
-        'creator': '/pkg:package/pkg:metadata/dc:creator'
+        'creator': '/pkg:package/pkg:metadata/dc:creator',
+        'series': '/pkg:package/pkg:metadata/pkg:meta[@name="calibre:series"]/@content',
+        'collection': '/pkg:package/pkg:metadata/pkg:meta[@property="belongs-to-collection"]',
+        'language': '/pkg:package/pkg:metadata/dc:language',
+        'date': '/pkg:package/pkg:metadata/dc:date',
+        'isbn': '/pkg:package/pkg:metadata/dc:identifier'
     },
     'fb2': {
         'title': '//fb:title-info/fb:book-title',
         'author': '//fb:title-info/fb:author',
         'first_name': 'fb:first-name',
-        'last_name': 'fb:last-name'
+        'last_name': 'fb:last-name',
+        'series': '//fb:title-info/fb:sequence/@name',
+        'language': '//fb:title-info/fb:lang',
+        'year': '//fb:publish-info/fb:year',
+        'date': '//fb:title-info/fb:date',
+        'isbn': '//fb:publish-info/fb:isbn'
     }
 }
 
@@ -54,3 +64,21 @@ initial_document_info = '''<?xml version="1.0" encoding="UTF-8"?>
 
 # Добавляем переменные ns и ns_map
 ns_output = {'fb': 'http://www.gribuser.ru/xml/fictionbook/2.0', 'xlink': 'http://www.w3.org/1999/xlink'}
+
+# Файл постоянного кэша метаданных в корне библиотеки
+metadata_cache_file = 'books/.metadata_cache.sqlite'
+
+# Файл кэша блоков авторов каталога output.fb2
+catalog_cache_file = 'books/.catalog_cache.sqlite'
+
+# Папка карантина для побайтных дубликатов (вне 'books', чтобы не попасть в каталог)
+duplicates_folder = 'duplicates'
+
+# Файл поискового индекса библиотеки (SQLite FTS5)
+library_index_file = 'books/.library_index.sqlite'
+
+# Журнал плана перемещений файлов (удаляется после выполнения плана)
+move_journal_file = 'books/.move_journal.jsonl'
+
+# Таблица псевдонимов имен авторов (канонические фамилии для объединения авторов)
+author_aliases_file = 'books/.author_aliases.sqlite'
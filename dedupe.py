@@ -0,0 +1,126 @@
+# Модуль поиска побайтно одинаковых книг: размер -> частичный хеш -> полный хеш BLAKE2.
+
+import hashlib
+import os
+
+PARTIAL_BLOCK = 64 * 1024  # Размер начального и конечного блоков частичного хеша
+CHUNK = 1024 * 1024  # Размер блока при потоковом чтении
+
+
+class Deduplicator:
+    # Находит среди новых файлов копии уже известных книг и друг друга.
+    # Хеши сохраняются в кэше метаданных и для неизмененных файлов повторно не вычисляются.
+
+    def __init__(self, cache):
+        # Принимает `cache` - объект MetadataCache.
+
+        self.cache = cache
+        self.bytes_hashed = 0  # Число прочитанных для хеширования байт
+
+    def find_duplicates(self, files):
+        # Ищет дубликаты новых файлов.
+        # Оригиналом считается файл библиотеки, а если его нет - первый из новых файлов в порядке списка.
+        # Принимает список `files` - пути к новым файлам.
+        # Возвращает словарь "путь к дубликату -> путь к оригиналу".
+
+        buckets = {}  # Размер -> список путей (сначала файлы библиотеки, затем новые)
+        stats = {}
+        new_files = set(map(os.path.abspath, files))
+        for file in map(os.path.abspath, files):
+            try:
+                stats[file] = os.stat(file)
+            except FileNotFoundError:
+                continue  # Файл исчез после чтения метаданных
+            size = stats[file].st_size
+            if size not in buckets:
+                buckets[size] = [path for path in self.cache.files_of_size(size) if path not in new_files]
+            buckets[size].append(file)
+
+        duplicates = {}
+        for size, paths in buckets.items():
+            if len(paths) < 2 or not new_files.intersection(paths):
+                continue  # Файл уникального размера не может иметь копий
+            paths = [path for path in paths if path in stats or self.stat_known(path, size, stats)]
+            for group in self.group_by(paths, stats, partial=True):
+                for same in self.group_by(group, stats, partial=False):
+                    original = same[0]
+                    for path in same[1:]:
+                        if path in new_files:
+                            duplicates[path] = original
+        return duplicates
+
+    def stat_known(self, path, size, stats):
+        # Проверяет, что файл библиотеки из кэша еще существует и не изменил размер, и запоминает его os.stat.
+        # Принимает строку `path`, `size` - ожидаемый размер и словарь `stats`.
+
+        try:
+            stats[path] = os.stat(path)
+        except OSError:
+            return False
+        return stats[path].st_size == size
+
+    def group_by(self, paths, stats, partial):
+        # Разбивает пути на группы с одинаковым хешем, отбрасывая группы из одного файла.
+        # Принимает список `paths`, словарь `stats` и `partial` - использовать частичный или полный хеш.
+        # Возвращает список групп в исходном порядке путей.
+
+        groups = {}
+        for path in paths:
+            try:
+                digest = self.digest(path, stats[path], partial)
+            except OSError as e:
+                print(f"Error hashing {path}: {e}")  # Файл исчез или не читается: в сравнении не участвует
+                continue
+            groups.setdefault(digest, []).append(path)
+        return [group for group in groups.values() if len(group) > 1]
+
+    def digest(self, path, stat, partial):
+        # Возвращает частичный или полный хеш файла, используя сохраненные значения.
+        # Для файлов не больше двух блоков частичный хеш совпадает с полным.
+        # Принимает строку `path`, `stat` - результат os.stat и `partial` - тип хеша.
+
+        saved_partial, saved_digest = self.cache.get_digests(stat)
+        small = stat.st_size <= 2 * PARTIAL_BLOCK
+        if partial and saved_partial is None:
+            saved_partial = self.hash_file(path, stat.st_size, partial=not small)
+            saved_digest = saved_partial if small else saved_digest
+            self.cache.put_digests(stat, saved_partial, saved_digest)
+        elif not partial and saved_digest is None:
+            saved_digest = self.hash_file(path, stat.st_size, partial=False)
+            self.cache.put_digests(stat, saved_partial, saved_digest)
+        return saved_partial if partial else saved_digest
+
+    def hash_file(self, path, size, partial):
+        # Вычисляет хеш BLAKE2 файла: частичный - по первому и последнему блокам, полный - потоково по всему файлу.
+        # Принимает строку `path`, `size` - размер файла и `partial` - тип хеша.
+        # Возвращает строку - шестнадцатеричный хеш.
+
+        digest = hashlib.blake2b(digest_size=32)
+        with open(path, 'rb') as file:
+            if partial:
+                blocks = [file.read(PARTIAL_BLOCK)]
+                file.seek(size - PARTIAL_BLOCK)
+                blocks.append(file.read(PARTIAL_BLOCK))
+            else:
+                blocks = iter(lambda: file.read(CHUNK), b'')
+            for block in blocks:
+                digest.update(block)
+                self.bytes_hashed += len(block)
+        return digest.hexdigest()
+
+
+def quarantine_destination(file, folder, taken=()):
+    # Выбирает путь для дубликата в папке карантина, не занятый файлами на диске и путями из `taken`.
+    # Принимает строки `file` - путь к дубликату, `folder` - папка карантина
+    # и множество `taken` - пути, уже назначенные другим файлам.
+    # Возвращает строку - путь к дубликату в папке карантина.
+
+    name = os.path.basename(file)
+    extension = '.fb2.zip' if name.endswith('.fb2.zip') else os.path.splitext(name)[1]  # "x (2).fb2.zip"
+    name = name[:len(name) - len(extension)]
+    destination = os.path.join(folder, name + extension)
+    number = 2
+    while destination in taken or os.path.exists(destination):
+        destination = os.path.join(folder, f'{name} ({number}){extension}')
+        number += 1
+    return destination
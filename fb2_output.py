@@ -1,31 +1,209 @@
 # Модуль для создания FB2 файла из словаря авторов.
 
+import hashlib
+import io
 import os
-from lxml import etree
-import xml.dom.minidom
 import re
-from config import initial_document_info
+import sqlite3
+import tempfile
+from contextlib import contextmanager
+from lxml import etree
+from config import initial_document_info, catalog_cache_file
 
 
-def create_fb2_file(merged_author_dict, ns):
+def create_fb2_file(merged_author_dict, ns, base_folder='books', full=False, fs=None):
     # Создает FB2 файл на основе объединенного словаря авторов.
-    # Принимает словарь `merged_author_dict` - объединенный словарь авторов и пространство имен `ns`.
-    # Возвращает строку - содержание файла формата FB2.
-
-    root = etree.fromstring(initial_document_info.encode('utf-8'))  # Создает корневой элемент с начальной информацией
-
-
-    for author, books in merged_author_dict.items():
-        create_author_block(root, author, books, ns)  # Создает блок данных для каждого автора
-    # Удаляет дублирующиеся строки
-    updated_content = remove_duplicate_lines_in_section(etree.tostring(root, encoding='utf-8').decode('utf-8'))
-    # Проверяет и удаляет несуществующие ссылки
-    updated_content = check_and_remove_nonexistent_links(updated_content, ns)
-    updated_content = remove_empty_subtitles(updated_content, ns)  # Удаляет пустые подзаголовки
-    dom = xml.dom.minidom.parseString(updated_content)  # Создает объект DOM для форматирования
-    formatted_content = dom.toprettyxml(indent="  ")  # Форматирует содержание
-
-    return save_to_fb2_file(formatted_content)  # Сохраняет содержание в файл формата FB2
+    # Блоки авторов хранятся в кэше фрагментов: заново формируются и проверяются только авторы,
+    # у которых изменился набор книг, итоговый файл склеивается из готовых фрагментов.
+    # Правила удаления дубликатов, несуществующих ссылок и пустых подзаголовков применяются при выводе блока.
+    # Принимает словарь `merged_author_dict` - объединенный словарь авторов, пространство имен `ns`,
+    # `base_folder` - папка библиотеки, `full` - полная пересборка всех блоков без использования кэша
+    # и `fs` - объект AsyncFS, чтобы файлы изменившихся авторов проверялись одновременно.
+
+    head, tail = render_catalog_frame(ns)  # Заголовок и окончание каталога
+    fragments = CatalogFragments(catalog_cache_file)
+
+    def lookup(author, books):
+        # Возвращает хеш набора книг автора и сохраненный блок (None, если блок нужно сформировать заново).
+
+        digest = books_digest(author, books)
+        return digest, None if full else fragments.get(author, digest)
+
+    cached = {}  # Автор -> результат lookup, уже полученный при проверке ссылок
+    is_file = os.path.isfile
+    if fs is not None:
+        cached = {author: lookup(author, books) for author, books in merged_author_dict.items()}
+        paths = [os.path.join(base_folder, f"{author}/{book}") for author, books in merged_author_dict.items()
+                 if cached[author][1] is None for book in books]
+        is_file = fs.run(fs.existing_files(paths)).__contains__
+
+    with atomic_output(os.path.join(base_folder, 'output.fb2')) as file:
+        file.write(head)
+        for author, books in merged_author_dict.items():
+            digest, fragment = cached.pop(author, None) or lookup(author, books)
+            if fragment is None:
+                fragment = render_author_block(author, books, ns, base_folder, is_file)  # Блок изменился
+                fragments.put(author, digest, fragment)
+            file.write(fragment)
+        file.write(tail)
+
+    fragments.prune(merged_author_dict.keys())  # Удаляет фрагменты исчезнувших авторов
+    fragments.close()
+
+
+class CatalogFragments:
+    # Кэш готовых блоков авторов каталога в SQLite, ключ - имя автора и хеш набора его книг.
+
+    def __init__(self, db_path):
+        # Открывает (или создает) базу фрагментов.
+        # Принимает `db_path` - путь к файлу SQLite.
+
+        folder = os.path.dirname(db_path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self.connection = sqlite3.connect(db_path)
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS fragments (author TEXT PRIMARY KEY, digest TEXT, fragment BLOB)')
+
+    def get(self, author, digest):
+        # Возвращает сохраненный блок автора, если набор книг не изменился, иначе None.
+        # Принимает строку `author` - имя автора и строку `digest` - хеш набора книг.
+
+        row = self.connection.execute(
+            'SELECT fragment FROM fragments WHERE author = ? AND digest = ?', (author, digest)).fetchone()
+        return row[0] if row else None
+
+    def put(self, author, digest, fragment):
+        # Сохраняет блок автора.
+        # Принимает строку `author`, строку `digest` - хеш набора книг и `fragment` - блок в байтах.
+
+        self.connection.execute('INSERT OR REPLACE INTO fragments VALUES (?, ?, ?)', (author, digest, fragment))
+
+    def prune(self, authors):
+        # Удаляет блоки авторов, которых больше нет в каталоге.
+        # Принимает `authors` - множество имен текущих авторов.
+
+        stale = [(author,) for author, in self.connection.execute('SELECT author FROM fragments')
+                 if author not in authors]
+        self.connection.executemany('DELETE FROM fragments WHERE author = ?', stale)
+
+    def close(self):
+        # Сохраняет изменения и закрывает базу.
+
+        self.connection.commit()
+        self.connection.close()
+
+
+def books_digest(author, books):
+    # Вычисляет хеш набора книг автора для проверки актуальности фрагмента.
+    # Принимает строку `author` - имя автора и множество `books` - книги автора.
+    # Возвращает строку - шестнадцатеричный хеш.
+
+    digest = hashlib.blake2b(author.encode('utf-8'), digest_size=16)
+    for book in sorted(books):
+        digest.update(b'\0' + book.encode('utf-8'))
+    return digest.hexdigest()
+
+
+def render_catalog_frame(ns):
+    # Формирует заголовок каталога (до содержимого секции) и его окончание.
+    # Принимает пространство имен `ns`.
+    # Возвращает кортеж байтовых строк (заголовок, окончание).
+
+    fb = f"{{{ns['fb']}}}"
+    buffer = io.BytesIO()
+    with etree.xmlfile(buffer, encoding='utf-8') as xf:
+        xf.write_declaration()
+        with xf.element(f'{fb}FictionBook', nsmap={None: ns['fb'], 'xlink': ns['xlink']}):
+            xf.write('\n  ')
+            write_element(xf, create_catalog_header(ns))  # Заголовок каталога из шаблона
+            xf.write('\n  ')
+            with xf.element(f'{fb}body'):
+                xf.write('\n    ')
+                with xf.element(f'{fb}section'):
+                    xf.flush()
+                    split = buffer.tell()  # Место вставки блоков авторов
+                    xf.write('\n    ')
+                xf.write('\n  ')
+            xf.write('\n')
+    content = buffer.getvalue()
+    return content[:split], content[split:]
+
+
+def render_author_block(author, books, ns, base_folder='books', is_file=os.path.isfile):
+    # Формирует блок автора в виде фрагмента XML без объявлений пространств имен.
+    # Принимает строку `author` - имя автора, множество `books` - книги автора,
+    # пространство имен `ns`, `base_folder` - папка библиотеки и `is_file` - проверка существования файла.
+    # Возвращает байтовую строку - фрагмент секции каталога.
+
+    buffer = io.BytesIO()
+    with etree.xmlfile(buffer, encoding='utf-8') as xf:
+        with xf.element(f"{{{ns['fb']}}}section", nsmap={None: ns['fb'], 'xlink': ns['xlink']}):
+            xf.flush()
+            start = buffer.tell()
+            create_author_block(xf, author, books, ns, base_folder, is_file)
+            xf.flush()
+            end = buffer.tell()
+    return buffer.getvalue()[start:end]
+
+
+@contextmanager
+def atomic_output(path):
+    # Открывает временный файл рядом с `path` для записи; после успешной записи сбрасывает его на диск
+    # и переименовывает в `path`, при ошибке удаляет, оставляя прежний файл нетронутым.
+    # Временный файл создается с правами 0600, поэтому перед заменой ему выставляются права прежнего файла
+    # (или обычные права нового файла с учетом umask), чтобы каталог оставался доступен другим читателям.
+    # Принимает строку `path` - путь к целевому файлу.
+
+    folder = os.path.dirname(path) or '.'
+    os.makedirs(folder, exist_ok=True)
+    file = tempfile.NamedTemporaryFile(dir=folder, prefix='.output-', suffix='.tmp', delete=False)
+    try:
+        with file:
+            yield file
+            file.flush()
+            os.fsync(file.fileno())
+        os.chmod(file.name, file_mode(path))
+        os.replace(file.name, path)  # Заменяет целевой файл целиком
+    except BaseException:
+        os.remove(file.name)
+        raise
+
+
+def file_mode(path):
+    # Возвращает права для файла `path`: права существующего файла или 0666 с учетом umask.
+
+    try:
+        return os.stat(path).st_mode & 0o7777
+    except FileNotFoundError:
+        umask = os.umask(0)
+        os.umask(umask)
+        return 0o666 & ~umask
+
+
+def create_catalog_header(ns):
+    # Создает блок <description> каталога из шаблона с удаленными дублирующимися строками.
+    # Принимает пространство имен `ns`.
+    # Возвращает элемент <description>.
+
+    content = remove_duplicate_lines_in_section(initial_document_info.strip())
+    parser = etree.XMLParser(remove_blank_text=True)
+    description = etree.fromstring(content.encode('utf-8'), parser).find('fb:description', namespaces=ns)
+    etree.indent(description, space='  ', level=1)  # Отступы в том же стиле, что и у остального каталога
+    return description
+
+
+def write_element(xf, element):
+    # Потоково выводит элемент со всем содержимым, сохраняя текст и отступы.
+    # Принимает `xf` - объект lxml.etree.xmlfile и элемент `element`.
+
+    with xf.element(element.tag, element.attrib):
+        if element.text:
+            xf.write(element.text)
+        for child in element:
+            write_element(xf, child)
+            if child.tail:
+                xf.write(child.tail)
 
 
 def remove_duplicate_lines_in_section(content):
@@ -46,71 +224,40 @@ def remove_duplicate_lines_in_section(content):
     return '\n'.join(unique_lines)  # Объединяет уникальные строки в одну строку
 
 
-def check_and_remove_nonexistent_links(content, ns):
-    # Проверяет и удаляет несуществующие ссылки из XML структуры FB2 файла.
-    # Принимает строку `content` - содержание FB2 файла. и пространство имен `ns`.
-    # Возвращает строку - содержание с удаленными несуществующими ссылками.
-
-    tree = etree.fromstring(content)  # Создает объект ElementTree из XML строки
-
-    for link in tree.xpath('.//fb:a[@xlink:href]', namespaces=ns):
-        xlink_href = os.path.join('books', link.get(f"{{{ns['xlink']}}}href"))  # Формирует полный путь к файлу
-        is_file_exists = os.path.isfile(xlink_href)  # Проверяет, существует ли файл
-
-        if not is_file_exists:
-            parent = link.getparent()
-            parent.getparent().remove(parent)  # Удаляет элемент из структуры, если файл не существует
-    # Преобразует структуру обратно в строку
-    return etree.tostring(tree, encoding='utf-8', xml_declaration=True).decode('utf-8')
-
-
-def remove_empty_subtitles(content, ns):
-    # Удаляет пустые подзаголовки из XML структуры FB2 файла.
-    # Принимает строку `content` - содержание FB2 файла и пространство имен `ns`.
-    # Возвращает строку - содержание с удаленными пустыми подзаголовками.
-
-    tree = etree.fromstring(content.encode('utf-8'))  # Создает объект ElementTree из XML строки
-
-    for subtitle_element in tree.xpath('.//fb:subtitle', namespaces=ns):
-        next_element = subtitle_element.getnext()
-
-        if next_element is not None and next_element.tag.endswith('p'):
-            continue
-        else:
-            parent = subtitle_element.getparent()
-            parent.remove(subtitle_element)  # Удаляет элемент из структуры, если следующий элемент не является абзацем
-    # Преобразует структуру обратно в строку
-    return etree.tostring(tree, encoding='utf-8', xml_declaration=True).decode('utf-8')
-
-
-def create_author_block(root, author, books, ns):
-    # Создает блок данных для каждого автора в XML структуре.
-    # Принимает элемент `root`, строку `author` - имя автора, список `books` - книги автора и пространство имен `ns`.
-
-    # Создает элемент подзаголовка
-    subtitle_element = etree.SubElement(root.find(".//fb:section", namespaces=ns), 'subtitle')
-    subtitle_element.text = author  # Устанавливает текст подзаголовка как имя автора
+def author_block_links(author, books, base_folder='books', is_file=os.path.isfile):
+    # Отбирает ссылки для блока автора: только книги с названием в «» и существующим файлом, без дубликатов.
+    # Принимает строку `author` - имя автора, множество `books` - книги автора, `base_folder` - папка библиотеки
+    # и `is_file` - проверка существования файла.
+    # Возвращает список пар (ссылка, название).
 
+    links = []
+    seen_links = set()
     for book in books:
         match = re.search(r'«(.*?)»', book)
-
-        if match:
-            title = match.group(1)
-            # Создает элемент абзаца
-            p_element = etree.SubElement(root.find(".//fb:section", namespaces=ns), 'p', name='book')
-            # Создает элемент ссылки на книгу
-
-            a_element = etree.SubElement(p_element, 'a', {f"{{{ns['xlink']}}}href": f"{author}/{book}"})
-
-
-            a_element.text = f'  - {title}'  # Устанавливает текст ссылки
-
-    etree.SubElement(root.find(".//fb:section", namespaces=ns), 'empty-line')  # Добавляет пустую строку
-
-
-def save_to_fb2_file(content):
-    # Сохраняет содержание в файл формата FB2.
-    # Принимает строку `content` - XML структура.
-
-    with open('books/output.fb2', 'w', encoding='utf-8') as file:
-        file.write(content)  # Записывает содержание в файл формата FB2
+        href = f"{author}/{book}"
+        if match and href not in seen_links and is_file(os.path.join(base_folder, href)):
+            links.append((href, match.group(1)))
+            seen_links.add(href)
+    return links
+
+
+def create_author_block(xf, author, books, ns, base_folder='books', is_file=os.path.isfile):
+    # Выводит блок данных для автора: подзаголовок, ссылки на книги и пустую строку.
+    # Подзаголовок не выводится, если у автора не осталось ни одной существующей книги.
+    # Принимает `xf` - объект lxml.etree.xmlfile, строку `author` - имя автора, множество `books` - книги автора,
+    # пространство имен `ns`, `base_folder` - папка библиотеки и `is_file` - проверка существования файла.
+
+    fb = f"{{{ns['fb']}}}"
+    links = author_block_links(author, books, base_folder, is_file)
+    if links:
+        xf.write('\n      ')
+        with xf.element(f'{fb}subtitle'):
+            xf.write(author)  # Имя автора в подзаголовке
+    for href, title in links:
+        xf.write('\n      ')
+        with xf.element(f'{fb}p', name='book'):
+            with xf.element(f'{fb}a', {f"{{{ns['xlink']}}}href": href}):
+                xf.write(f'  - {title}')  # Название книги - ссылка на файл
+    xf.write('\n      ')
+    with xf.element(f'{fb}empty-line'):
+        pass  # Добавляет пустую строку
@@ -0,0 +1,204 @@
+# Модуль замеров конвейера: время и CPU по фазам, счетчики по файлам и отчет о запуске в JSON.
+# По умолчанию замеры выключены, и функции модуля почти ничего не делают.
+
+import cProfile
+import heapq
+import json
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+
+# Ошибки разбора и число прочитанных байт для файла, замеряемого в текущем процессе через measure_file
+_file_errors = []
+_file_bytes = [0]
+_measuring = [False]
+
+
+class Phase:
+    # Замер одной фазы; поле `items` задает число обработанных файлов для расчета скорости.
+
+    def __init__(self, name):
+        self.name = name
+        self.items = None
+
+
+class Instrumentation:
+    # Собирает замеры запуска.
+
+    def __init__(self, slowest=10, trace_memory=False, profile_path=None):
+        # Принимает `slowest` - число самых медленных файлов в отчете, `trace_memory` - замерять пик памяти
+        # Python по фазам через tracemalloc и `profile_path` - файл для статистики cProfile.
+
+        self.phases = []
+        self.files = 0
+        self.bytes_read = 0
+        self.failures = Counter()
+        self.counters = Counter()
+        self.slowest = slowest
+        self.slowest_files = []  # Куча (время, путь)
+        self.trace_memory = trace_memory
+        self.profile_path = profile_path
+        self.profiler = None
+        self.started = time.perf_counter()
+        self.cpu_started = time.process_time()
+        if trace_memory:
+            tracemalloc.start()
+        if profile_path:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+    @contextmanager
+    def phase(self, name):
+        # Замеряет время, процессорное время и (при включенном tracemalloc) пик памяти фазы.
+        # Принимает строку `name` - имя фазы.
+
+        phase = Phase(name)
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield phase
+        finally:
+            entry = {'name': name, 'wall': time.perf_counter() - wall, 'cpu': time.process_time() - cpu}
+            if phase.items is not None:
+                entry['items'] = phase.items
+                entry['items_per_second'] = phase.items / entry['wall'] if entry['wall'] else None
+            if self.trace_memory:
+                entry['peak_python_memory'] = tracemalloc.get_traced_memory()[1]
+            self.phases.append(entry)
+
+    def record_file(self, sample):
+        # Учитывает замер одного файла, полученный из measure_file.
+        # Принимает кортеж `sample` - (путь, время, процессорное время, прочитанные байты, ошибки).
+
+        file, wall, cpu, bytes_read, errors = sample
+        self.files += 1
+        self.bytes_read += bytes_read
+        self.failures.update(errors)
+        entry = (wall, file)
+        if len(self.slowest_files) < self.slowest:
+            heapq.heappush(self.slowest_files, entry)
+        elif entry > self.slowest_files[0]:
+            heapq.heapreplace(self.slowest_files, entry)
+
+    def count(self, name, value=1):
+        # Увеличивает именованный счетчик.
+
+        self.counters[name] += value
+
+    def report(self):
+        # Возвращает отчет о запуске в виде словаря.
+
+        return {
+            'wall': time.perf_counter() - self.started,
+            'cpu': time.process_time() - self.cpu_started,
+            'phases': self.phases,
+            'files': self.files,
+            'bytes_read': self.bytes_read,
+            'parse_failures': dict(self.failures),
+            'counters': dict(self.counters),
+            'slowest_files': [{'file': file, 'wall': wall} for wall, file in sorted(self.slowest_files, reverse=True)],
+        }
+
+    def summary(self, report):
+        # Формирует краткую текстовую сводку по отчету.
+
+        lines = [f"Run: {report['wall']:.2f} s wall, {report['cpu']:.2f} s CPU, {report['files']} files, "
+                 f"{report['bytes_read'] / 1024 / 1024:.1f} MB read"]
+        for phase in report['phases']:
+            rate = f", {phase['items_per_second']:.0f} items/s" if phase.get('items_per_second') else ''
+            lines.append(f"  {phase['name']:<28} {phase['wall']:8.3f} s wall {phase['cpu']:8.3f} s CPU{rate}")
+        if report['parse_failures']:
+            failures = ', '.join(f'{name}: {count}' for name, count in report['parse_failures'].items())
+            lines.append(f'  parse failures: {failures}')
+        if report['slowest_files']:
+            slowest = report['slowest_files'][0]
+            lines.append(f"  slowest file: {slowest['file']} ({slowest['wall'] * 1000:.1f} ms)")
+        return '\n'.join(lines)
+
+    def finish(self, report_path):
+        # Останавливает профилировщики, записывает отчет в JSON и печатает сводку.
+        # Принимает `report_path` - путь к файлу отчета.
+
+        if self.profiler is not None:
+            self.profiler.disable()
+            self.profiler.dump_stats(self.profile_path)
+        report = self.report()
+        if self.trace_memory:
+            report['peak_python_memory'] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        with open(report_path, 'w', encoding='utf-8') as file:
+            json.dump(report, file, indent=2, ensure_ascii=False)
+        print(self.summary(report))
+        return report
+
+
+current = None  # Активный объект Instrumentation или None, если замеры выключены
+
+
+def enable(**options):
+    # Включает замеры для текущего запуска.
+    # Принимает параметры Instrumentation.
+    # Возвращает созданный объект Instrumentation.
+
+    global current
+    current = Instrumentation(**options)
+    return current
+
+
+def enabled():
+    # Возвращает True, если замеры включены.
+
+    return current is not None
+
+
+def phase(name):
+    # Контекстный менеджер замера фазы; при выключенных замерах ничего не делает.
+
+    return current.phase(name) if current is not None else nullcontext(Phase(name))
+
+
+def parse_failure(error):
+    # Запоминает ошибку разбора файла, обрабатываемого в текущем процессе.
+
+    if _measuring[0]:
+        _file_errors.append(type(error).__name__)
+
+
+def add_bytes_read(count):
+    # Учитывает прочитанные из файла байты в текущем процессе.
+
+    if _measuring[0]:
+        _file_bytes[0] += count
+
+
+def measure_file(function, file):
+    # Вызывает обработчик файла и замеряет его; выполняется и в процессах пула.
+    # Принимает функцию `function` и путь `file`.
+    # Возвращает кортеж (результат, (путь, время, процессорное время, прочитанные байты, ошибки)).
+
+    del _file_errors[:]
+    _file_bytes[0] = 0
+    _measuring[0] = True
+    wall, cpu = time.perf_counter(), time.process_time()
+    try:
+        result = function(file)
+    finally:
+        _measuring[0] = False
+    sample = (file, time.perf_counter() - wall, time.process_time() - cpu, _file_bytes[0], list(_file_errors))
+    return result, sample
+
+
+def record_file(sample):
+    # Передает замер файла активному объекту Instrumentation.
+
+    if current is not None:
+        current.record_file(sample)
+
+
+def count(name, value=1):
+    # Увеличивает именованный счетчик активного объекта Instrumentation.
+
+    if current is not None:
+        current.count(name, value)
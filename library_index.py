@@ -0,0 +1,186 @@
+# Модуль поискового индекса библиотеки на основе SQLite FTS5: названия, авторы, серии и группы авторов.
+
+import os
+import re
+import sqlite3
+
+# Триггеры синхронизации полнотекстового индекса с таблицей books
+TRIGGERS = [
+    '''CREATE TRIGGER IF NOT EXISTS books_insert AFTER INSERT ON books BEGIN
+        INSERT INTO books_fts (rowid, title, authors, series) VALUES (new.id, new.title, new.authors, new.series);
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS books_delete AFTER DELETE ON books BEGIN
+        INSERT INTO books_fts (books_fts, rowid, title, authors, series)
+        VALUES ('delete', old.id, old.title, old.authors, old.series);
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS books_update AFTER UPDATE OF title, authors, series ON books BEGIN
+        INSERT INTO books_fts (books_fts, rowid, title, authors, series)
+        VALUES ('delete', old.id, old.title, old.authors, old.series);
+        INSERT INTO books_fts (rowid, title, authors, series) VALUES (new.id, new.title, new.authors, new.series);
+    END''',
+]
+
+# Запрос, совпавший с большим числом книг, возвращается без ранжирования: bm25 вычисляется для каждого
+# совпадения, и на сотнях тысяч книг это занимает сотни миллисекунд
+RANK_LIMIT = 1000
+
+
+class LibraryIndex:
+    # Индекс книг библиотеки. Строка книги хранит папку автора и имя файла, полнотекстовый индекс
+    # books_fts (внешнее содержимое таблицы books) поддерживается триггерами.
+    # Таблица author_aliases хранит группы авторов из compare_and_merge_keys: ключ автора -> папка группы.
+
+    def __init__(self, db_path):
+        # Открывает (или создает) базу индекса.
+        # Принимает `db_path` - путь к файлу SQLite.
+
+        folder = os.path.dirname(db_path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self.connection = sqlite3.connect(db_path)
+        self.connection.executescript('''
+            CREATE TABLE IF NOT EXISTS books (
+                id INTEGER PRIMARY KEY, name TEXT UNIQUE, author TEXT, title TEXT, authors TEXT, format TEXT,
+                series TEXT, language TEXT, year INTEGER, isbn TEXT);
+            CREATE INDEX IF NOT EXISTS books_author ON books (author);
+            CREATE INDEX IF NOT EXISTS books_isbn ON books (isbn);
+            CREATE VIRTUAL TABLE IF NOT EXISTS books_fts USING fts5 (
+                title, authors, series, content='books', content_rowid='id', tokenize='unicode61 remove_diacritics 2');
+            CREATE TABLE IF NOT EXISTS author_aliases (alias TEXT PRIMARY KEY, author TEXT);
+            CREATE INDEX IF NOT EXISTS author_aliases_author ON author_aliases (author);
+        ''')
+        for statement in TRIGGERS:
+            self.connection.execute(statement)
+
+    def update(self, merged_author_dict, processed, groups, full=False):
+        # Обновляет индекс в одной транзакции.
+        # Принимает словарь `merged_author_dict` - объединенный словарь авторов, словарь `processed` - результат
+        # ingest_files, словарь `groups` - "ключ автора -> папка группы" и `full` - `merged_author_dict` содержит
+        # всю библиотеку: тогда индекс сверяется с ней целиком (переезды между папками, удаленные книги,
+        # книги без записи в индексе), а ключи групп, папок которых больше нет, удаляются.
+
+        with self.connection:
+            rows = []
+            for author, books in merged_author_dict.items():
+                for book in books & processed.keys():
+                    file, format_type, title, author_names, details = processed[book]
+                    rows.append(book_row(book, author, format_type, title, author_names, details))
+
+            if full:
+                indexed = dict(self.connection.execute('SELECT name, author FROM books'))
+                moved = []
+                for author, books in merged_author_dict.items():
+                    for book in books:
+                        indexed_author = indexed.pop(book, None)
+                        if book in processed:
+                            continue
+                        if indexed_author is None:
+                            rows.append(row_from_name(book, author))  # Книга, добавленная до появления индекса
+                        elif indexed_author != author:
+                            moved.append((author, book))
+                self.connection.executemany('UPDATE books SET author = ? WHERE name = ?', moved)
+                self.connection.executemany('DELETE FROM books WHERE name = ?', [(book,) for book in indexed])
+                # Ключи прежних запусков сохраняются: папка, вошедшая в другую группу, переносится в нее
+                self.connection.executemany('UPDATE author_aliases SET author = ? WHERE author = ?',
+                                            [(group, key) for key, group in groups.items() if key != group])
+            self.upsert([row for row in rows if row is not None])
+            self.connection.executemany('INSERT OR REPLACE INTO author_aliases VALUES (?, ?)', groups.items())
+            if full:
+                stale = [(alias,) for alias, author in self.connection.execute('SELECT * FROM author_aliases')
+                         if author not in merged_author_dict]
+                self.connection.executemany('DELETE FROM author_aliases WHERE alias = ?', stale)  # Папки группы больше нет
+
+    def upsert(self, rows):
+        # Добавляет или обновляет строки книг (кортежи в порядке столбцов books без id).
+        # Большой пакет записывается без триггеров с последующей пересборкой полнотекстового индекса:
+        # пересборка всей таблицы быстрее, чем построчное обновление индекса триггерами.
+
+        total = self.connection.execute('SELECT count(*) FROM books').fetchone()[0]
+        bulk = len(rows) > 10000 and len(rows) * 8 > total
+        if bulk:
+            for name in ['books_insert', 'books_delete', 'books_update']:
+                self.connection.execute(f'DROP TRIGGER {name}')
+        self.connection.executemany(
+            'INSERT INTO books (name, author, title, authors, format, series, language, year, isbn) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT (name) DO UPDATE SET author = excluded.author, '
+            'title = excluded.title, authors = excluded.authors, format = excluded.format, '
+            'series = excluded.series, language = excluded.language, year = excluded.year, isbn = excluded.isbn',
+            rows)
+        if bulk:
+            self.connection.execute("INSERT INTO books_fts (books_fts) VALUES ('rebuild')")
+            for statement in TRIGGERS:
+                self.connection.execute(statement)
+
+    def rename_author(self, old, new):
+        # Переносит книги и ключи группы авторов в новую папку группы.
+        # Принимает строки `old` и `new` - прежнее и новое имя папки.
+
+        with self.connection:
+            self.connection.execute('UPDATE books SET author = ? WHERE author = ?', (new, old))
+            self.connection.execute('UPDATE author_aliases SET author = ? WHERE author = ?', (new, old))
+
+    def search(self, query, limit=20):
+        # Ищет книги по словам из названия, авторов и серии (все слова должны совпасть, последнее - как префикс).
+        # Принимает строку `query` - запрос и `limit` - наибольшее число результатов.
+        # Возвращает список словарей книг, самые релевантные первыми
+        # (при числе совпадений больше RANK_LIMIT - первые совпадения без ранжирования).
+
+        words = re.findall(r'\w+', query)
+        if not words:
+            return []
+        match = ' '.join(f'"{word}"' for word in words) + '*'
+        matches = self.connection.execute(
+            'SELECT count(*) FROM (SELECT rowid FROM books_fts WHERE books_fts MATCH ? LIMIT ?)',
+            (match, RANK_LIMIT + 1)).fetchone()[0]
+        order = 'ORDER BY rank ' if matches <= RANK_LIMIT else ''
+        return self.fetch(
+            'SELECT books.* FROM books_fts JOIN books ON books.id = books_fts.rowid '
+            f'WHERE books_fts MATCH ? {order}LIMIT ?', (match, limit))
+
+    def books_by_author(self, author, signature_of=None):
+        # Возвращает книги группы авторов: ключ автора сначала ищется среди сохраненных групп,
+        # а если такого ключа нет - среди ключей с той же сигнатурой (другой порядок слов, транслитерация).
+        # Принимает строку `author` - ключ автора, например "Лев Толстой", или имя папки группы
+        # и `signature_of` - функция сигнатуры, с которой объединялись авторы (AuthorAliases.signature).
+
+        row = self.connection.execute('SELECT author FROM author_aliases WHERE alias = ?', (author,)).fetchone()
+        if row is None and signature_of is not None:
+            signature = signature_of(author)
+            row = next(((group,) for alias, group in self.connection.execute('SELECT * FROM author_aliases')
+                        if signature_of(alias) == signature), None)
+        return self.fetch('SELECT * FROM books WHERE author = ? ORDER BY title', (row[0] if row else author,))
+
+    def fetch(self, sql, parameters):
+        # Выполняет запрос к таблице books и возвращает строки в виде словарей с путем к файлу в поле 'path'.
+
+        cursor = self.connection.execute(sql, parameters)
+        columns = [column[0] for column in cursor.description]
+        books = []
+        for row in cursor:
+            book = dict(zip(columns, row))
+            book['path'] = os.path.join('books', book['author'], book['name'])
+            books.append(book)
+        return books
+
+    def close(self):
+        # Закрывает базу.
+
+        self.connection.close()
+
+
+def book_row(name, author, format_type, title, author_names, details):
+    # Формирует строку таблицы books.
+
+    return (name, author, title, ', '.join(filter(None, author_names)), format_type, details.get('series'),
+            details.get('language'), details.get('year'), details.get('isbn'))
+
+
+def row_from_name(name, author):
+    # Формирует строку таблицы books по имени файла вида "«Название», Авторы.расширение".
+    # Возвращает None для файлов, не похожих на книгу.
+
+    match = re.fullmatch(r'«(.*)», (.*)\.(epub|fb2|fb2\.zip)', name)
+    if match is None:
+        return None
+    title, author_names, format_type = match.groups()
+    return book_row(name, author, format_type, title, [author_names], {})
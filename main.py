@@ -1,12 +1,22 @@
 # main.py обрабатывает EPUB и FB2 файлы, организуя их по авторам в папке 'books'.
 
+import argparse
 import zipfile
 from lxml import etree
 import os
 import re
-import shutil
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
 from fb2_output import create_fb2_file
-from config import xpath_values, namespace, ns_output
+from config import (xpath_values, namespace, ns_output, metadata_cache_file, duplicates_folder, library_index_file,
+                    move_journal_file, author_aliases_file)
+from author_names import AuthorAliases
+from dedupe import Deduplicator, quarantine_destination
+from library_index import LibraryIndex
+from metadata_cache import MetadataCache
+from move_plan import MovePlan, recover_journal
+from async_fs import AsyncFS
+import instrumentation
 
 
 def normalize_filename(filename):
@@ -21,8 +31,8 @@ def normalize_filename(filename):
 
 
 def read_metadata_from_file(file, format_type):
-    # Читает метаданные из файлов EPUB и FB2.
-    # Принимает `file` - путь к файлу, `format_type` - расширение (EPUB или FB2).
+    # Читает метаданные из файлов EPUB, FB2 и FB2.ZIP (архив не распаковывается на диск).
+    # Принимает `file` - путь к файлу, `format_type` - формат (EPUB или FB2).
     # Возвращает объект ElementTree - дерево элементов XML с метаданными.
 
     tree = None
@@ -37,16 +47,38 @@ def read_metadata_from_file(file, format_type):
             container_file_name = container_tree.xpath(xpath['container'], namespaces=ns)[
                 0]  # Находит имя основного файла
             container_file = archive.read(container_file_name)  # Читает содержимое основного файла
+            instrumentation.add_bytes_read(len(txt) + len(container_file))
             tree = etree.fromstring(container_file)  # Создает дерево элементов из основного файла
             archive.close()  # Закрывает архив
         elif file.endswith('.fb2'):
-            tree = etree.parse(file)  # Читает FB2-файл
+            with open(file, 'rb') as fb2_file:
+                tree = read_fb2_header(fb2_file)  # Читает только заголовок FB2-файла
+                instrumentation.add_bytes_read(fb2_file.tell())
+        elif file.endswith('.fb2.zip'):
+            with zipfile.ZipFile(file) as archive:  # Открывает архив с FB2
+                member = next(name for name in archive.namelist() if name.lower().endswith('.fb2'))
+                with archive.open(member) as fb2_file:
+                    tree = read_fb2_header(fb2_file)  # Распаковывает только начало файла до конца заголовка
+                    instrumentation.add_bytes_read(fb2_file.tell())
     except Exception as e:
         print(f"Error reading metadata from {file}: {e}")  # Выводит сообщение об ошибке, если что-то идет не так
+        instrumentation.parse_failure(e)
 
     return tree  # Возвращает дерево элементов XML с метаданными
 
 
+def read_fb2_header(stream):
+    # Потоково читает FB2 до закрывающего тега </description>, не загружая тело книги и вложения <binary>.
+    # Принимает `stream` - открытый в двоичном режиме файловый объект.
+    # Возвращает элемент <description> (xpath из config.py работают от корня частично построенного дерева)
+    # или None, если блок описания не найден.
+
+    description_tag = f"{{{namespace['fb']}}}description"
+    for event, element in etree.iterparse(stream, events=('end',), tag=description_tag):
+        return element  # Прекращает чтение сразу после блока описания
+    return None
+
+
 def set_new_filename(title, authors, extension):
     # Формирует новое нормализованное имя файла на основе заголовка, авторов и расширения.
     # Принимает `title` - заголовок книги, список `authors` - имена авторов, `extension` - расширение файла.
@@ -56,116 +88,300 @@ def set_new_filename(title, authors, extension):
     return normalize_filename(new_name)  # Возврат нормализованного имени файла
 
 
-def process_common(file, author_dict, extension, title, author_names):
-    # Общая функция для обработки файлов, формирует новое имя, перемещает файл и обновляет словарь авторов.
-    # Принимает `file` - путь к файлу, словарь `author_dict` - словарь авторов,
-    # `extension` - расширение файла, `title` - заголовок книги, список `author_names` - имена авторов.
+def unique_filename(title, authors, extension, taken):
+    # Формирует имя файла, не совпадающее с уже занятыми: при совпадении добавляет суффикс " (2)", " (3)" и т.д.
+    # Принимает `title` - заголовок книги, список `authors` - имена авторов, `extension` - расширение файла
+    # и множество `taken` - занятые имена файлов.
+    # Возвращает строку - нормализованное имя файла.
+
+    new_name = set_new_filename(title, authors, extension)
+    number = 2
+    while new_name in taken or os.path.exists(f'books/{new_name}'):
+        new_name = normalize_filename(f'«{title}», {", ".join(authors)} ({number}).{extension}')
+        number += 1
+    return new_name
 
-    new_name = set_new_filename(title, author_names, extension)  # Формирование нового нормализованного имени файла
-    os.rename(file, f'books/{new_name}')  # Переименование файла с учетом нового имени и перемещение в папку 'books'
+
+def add_book(author_dict, extension, title, author_names, taken=None):
+    # Формирует новое имя файла и добавляет книгу в словарь авторов, не изменяя файловую систему.
+    # Принимает словарь `author_dict` - словарь авторов, `extension` - расширение файла, `title` - заголовок книги,
+    # список `author_names` - имена авторов и множество `taken` - имена файлов библиотеки.
+    # Возвращает строку - новое имя файла.
+
+    if taken is None:
+        new_name = set_new_filename(title, author_names, extension)  # Формирование нового нормализованного имени
+    else:
+        new_name = unique_filename(title, author_names, extension, taken)  # Имя без перезаписи другой книги
+        taken.add(new_name)
 
     key = ", ".join(author_names)  # Формирование ключа для словаря авторов
     key = normalize_filename(key)  # Нормализация ключа
     if key not in author_dict:
         author_dict[key] = set()
     author_dict[key].add(new_name)  # Добавление нового имени в множество автора
+    return new_name
 
 
-def process_epub(file, author_dict):
-    # Обрабатывает файл формата EPUB, извлекает метаданные и вызывает общую функцию для обработки.
-    # Принимает `file` - путь к файлу и словарь `author_dict` - словарь авторов.
+def extract_epub_metadata(file):
+    # Извлекает метаданные из файла EPUB, не изменяя файловую систему.
+    # Принимает `file` - путь к файлу.
+    # Возвращает кортеж (путь, формат, заголовок, список авторов, дополнительные метаданные)
+    # или None, если метаданные не прочитаны.
 
     format_type = 'epub'
     xpath = xpath_values[format_type]  # Получение соответствующих значений XPath из конфигурации
     ns = namespace
     tree = read_metadata_from_file(file, format_type)  # Получение дерева элементов с метаданными из файла
 
-    if tree is not None:
-        title = tree.xpath(xpath['title'], namespaces=ns)[0]  # Извлечение заголовка книги
-        creators = tree.xpath(xpath['creator'], namespaces=ns)  # Извлечение списка авторов
-        author_names = [creator.text for creator in creators]  # Формирование списка имен авторов
-        process_common(file, author_dict, 'epub', title.text, author_names)  # Вызов общей функции для обработки
-    # else:
-    #     print(f"Error processing EPUB file: {file}")
+    if tree is None:
+        return None
+    title = tree.xpath(xpath['title'], namespaces=ns)[0]  # Извлечение заголовка книги
+    creators = tree.xpath(xpath['creator'], namespaces=ns)  # Извлечение списка авторов
+    author_names = [creator.text for creator in creators]  # Формирование списка имен авторов
+    return file, format_type, title.text, author_names, book_details(tree, xpath)
 
 
-def process_fb2(file, author_dict):
-    # Обрабатывает файл формата FB2, извлекает метаданные и вызывает общую функцию для обработки.
-    # Принимает строку `file` - путь к файлу и словарь `author_dict` - словарь авторов.
+def extract_fb2_metadata(file):
+    # Извлекает метаданные из файла FB2 или архива FB2.ZIP, не изменяя файловую систему.
+    # Принимает строку `file` - путь к файлу.
+    # Возвращает кортеж (путь, формат, заголовок, список авторов, дополнительные метаданные)
+    # или None, если метаданные не прочитаны.
+    # Для архива формат - 'fb2.zip', и книга сохраняется в библиотеке в виде архива.
 
     format_type = 'fb2'
+    extension = 'fb2.zip' if file.endswith('.fb2.zip') else format_type
     xpath = xpath_values[format_type]  # Получение соответствующих значений XPath из конфигурации
     ns = namespace
     tree = read_metadata_from_file(file, format_type)  # Получение дерева элементов с метаданными из файла
 
-    if tree is not None:
-        title = tree.xpath(xpath['title'], namespaces=ns)  # Извлечение заголовка книги
-        title = title[0].text.strip() if title and title[0].text else 'Unknown Title'  # Проверка и получение заголовка
-        author_elements = tree.xpath(xpath['author'], namespaces=ns)  # Извлечение элементов имени авторов
-        author_names = [
-            f"{author.xpath(xpath['first_name'], namespaces=ns)[0].text} "
-            f"{author.xpath(xpath['last_name'], namespaces=ns)[0].text}"
-            if author.xpath(xpath['first_name'], namespaces=ns) and author.xpath(xpath['last_name'], namespaces=ns)
-            else author.xpath(xpath['first_name'], namespaces=ns)[0].text
-            if author.xpath(xpath['first_name'], namespaces=ns)
-            else 'Unknown'
-            for author in author_elements]  # Формирование списка имен авторов
-        process_common(file, author_dict, 'fb2', title, author_names)  # Вызов общей функции для обработки
-    else:
-        pass
-        # print(f"Error processing FB2 file: {file}")
+    if tree is None:
+        return None
+    title = tree.xpath(xpath['title'], namespaces=ns)  # Извлечение заголовка книги
+    title = title[0].text.strip() if title and title[0].text else 'Unknown Title'  # Проверка и получение заголовка
+    author_elements = tree.xpath(xpath['author'], namespaces=ns)  # Извлечение элементов имени авторов
+    author_names = [
+        f"{author.xpath(xpath['first_name'], namespaces=ns)[0].text} "
+        f"{author.xpath(xpath['last_name'], namespaces=ns)[0].text}"
+        if author.xpath(xpath['first_name'], namespaces=ns) and author.xpath(xpath['last_name'], namespaces=ns)
+        else author.xpath(xpath['first_name'], namespaces=ns)[0].text
+        if author.xpath(xpath['first_name'], namespaces=ns)
+        else 'Unknown'
+        for author in author_elements]  # Формирование списка имен авторов
+    return file, extension, title, author_names, book_details(tree, xpath)
+
+
+def book_details(tree, xpath):
+    # Извлекает дополнительные метаданные для поискового индекса: серию, язык, год и ISBN.
+    # Принимает `tree` - дерево элементов с метаданными и словарь `xpath` - значения XPath формата из config.py.
+    # Возвращает словарь; ненайденные значения равны None.
+
+    date = first_value(tree, xpath.get('year'), xpath['date'])
+    year = re.search(r'\d{4}', date) if date else None
+    isbn = None
+    for identifier in tree.xpath(xpath['isbn'], namespaces=namespace):  # В EPUB ISBN - один из dc:identifier
+        isbn = normalize_isbn(identifier.text)
+        if isbn:
+            break
+    return {
+        'series': first_value(tree, xpath['series'], xpath.get('collection')),
+        'language': first_value(tree, xpath['language']),
+        'year': int(year.group()) if year else None,
+        'isbn': isbn,
+    }
+
+
+def first_value(tree, *paths):
+    # Возвращает первое непустое значение (текст элемента или атрибута) по списку XPath или None.
+    # Принимает `tree` - дерево элементов и выражения `paths` (None пропускаются).
+
+    for path in filter(None, paths):
+        for value in tree.xpath(path, namespaces=namespace):
+            text = value if isinstance(value, str) else value.text
+            if text and text.strip():
+                return text.strip()
+    return None
+
+
+def normalize_isbn(text):
+    # Приводит ISBN к виду без дефисов и пробелов, например "urn:isbn:978-5-17-090630-9" -> "9785170906309".
+    # Принимает строку `text` или None.
+    # Возвращает строку или None, если это не ISBN.
+
+    if not text:
+        return None
+    isbn = re.sub(r'[\s-]', '', text).upper()
+    isbn = re.sub(r'^(URN:)?ISBN:?', '', isbn)
+    return isbn if re.fullmatch(r'(97[89])?\d{9}[\dX]', isbn) else None
+
+
+def extract_metadata(file):
+    # Чистая стадия извлечения метаданных: выбирает обработчик по расширению файла.
+    # Выполняется в процессах пула, поэтому не трогает файлы и словарь авторов.
+    # Принимает `file` - путь к файлу.
+    # Возвращает кортеж (путь, формат, заголовок, список авторов, дополнительные метаданные) или None.
+
+    try:
+        if re.fullmatch(r'.*\.epub', file):
+            return extract_epub_metadata(file)
+        elif re.fullmatch(r'.*\.fb2(\.zip)?', file):
+            return extract_fb2_metadata(file)
+    except Exception as e:
+        print(f"Error processing {file}: {e}")
+        instrumentation.parse_failure(e)
+    return None
+
+
+def apply_metadata(record, author_dict, taken=None):
+    # Последовательная стадия: назначает файлу новое имя по извлеченным метаданным и обновляет словарь авторов.
+    # Файл не перемещается: перемещение в папку автора добавляется в план (plan_books_by_author).
+    # Принимает кортеж `record` - (путь, формат, заголовок, список авторов, дополнительные метаданные),
+    # словарь `author_dict` и множество `taken` - занятые имена файлов.
+    # Возвращает строку - новое имя файла.
+
+    file, format_type, title, author_names = record[:4]
+    return add_book(author_dict, format_type, title, author_names, taken)
+
+
+def extract_metadata_parallel(files, workers=1, chunksize=64):
+    # Извлекает метаданные из списка файлов в пуле процессов с порционной отправкой задач.
+    # Принимает список `files` - пути к файлам, `workers` - число процессов, `chunksize` - размер порции.
+    # Возвращает генератор записей в исходном порядке файлов (None для непрочитанных файлов).
+    # При включенных замерах каждый файл замеряется в своем процессе, замеры передаются в instrumentation.
+
+    handler = extract_metadata
+    if instrumentation.enabled():
+        handler = partial(instrumentation.measure_file, extract_metadata)
+    if workers <= 1:
+        results = map(handler, files)  # Без пула, в текущем процессе
+        yield from collect_samples(results)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        yield from collect_samples(executor.map(handler, files, chunksize=chunksize))
+
+
+def collect_samples(results):
+    # Передает замеры файлов в instrumentation (если замеры включены) и возвращает только записи.
+    # Принимает итератор `results` - записи или пары (запись, замер).
+
+    if not instrumentation.enabled():
+        yield from results
+        return
+    for record, sample in results:
+        instrumentation.record_file(sample)
+        yield record
+
+
+def extract_metadata_cached(files, cache, workers=1):
+    # Извлекает метаданные с использованием постоянного кэша: разбираются только новые и измененные файлы.
+    # Принимает список `files` - пути к файлам, `cache` - объект MetadataCache и `workers` - число процессов.
+    # Возвращает список записей в исходном порядке файлов (None для непрочитанных и исчезнувших файлов).
+
+    records = {}
+    stats = {}
+    misses = []
+    for file in files:
+        try:
+            stats[file] = os.stat(file)
+        except FileNotFoundError:
+            records[file] = None  # Файл удален или перемещен после того, как попал в список
+            continue
+        record = cache.get(os.path.abspath(file), stats[file])
+        if record is None:
+            misses.append(file)  # Новый или измененный файл
+        else:
+            records[file] = record or None
+
+    for file, record in zip(misses, extract_metadata_parallel(misses, workers)):
+        cache.put(os.path.abspath(file), stats[file], record)  # Нечитаемые файлы тоже запоминаются
+        records[file] = record
+
+    return [records[file] for file in files]
+
+
+def author_signature(key):
+    # Формирует сигнатуру ключа авторов - неизменяемое множество фамилий.
+    # Принимает строку `key` - ключ словаря авторов вида "Имя Фамилия, Имя Фамилия".
+    # Возвращает frozenset - множество фамилий.
 
+    return frozenset(author.split()[-1] for author in key.split(', '))
 
-def compare_and_merge_keys(author_dict):
+
+def compare_and_merge_keys(author_dict, signature_of=author_signature):
     # Сравнивает и объединяет ключи словаря авторов на основе фамилий.
-    # Принимает словарь 'author_dict' - словарь авторов.
+    # Сигнатура каждого ключа вычисляется один раз, группы собираются за один проход по хеш-индексу.
+    # Каноническим именем группы становится ключ, добавленный в словарь последним.
+    # Принимает словарь 'author_dict' - словарь авторов (после вызова словарь пуст)
+    # и `signature_of` - функция сигнатуры ключа (AuthorAliases.signature - с канонизацией имен).
     # Возвращает словарь 'merged_dict' - объединенный словарь авторов.
 
-    merged_dict = {}
-    while author_dict:
-        key1, books1 = author_dict.popitem()  # Извлекает ключ и соответствующее множество книг
-        author_last_names = set(author.split()[-1] for author in key1.split(', '))  # Извлекает фамилии из ключа
-        matching_keys = [key2 for key2 in author_dict.keys() if set(author.split()[-1] for author in key2.split(', '))
-                         == author_last_names]  # Ищет ключи с совпадающими фамилиями
-        if matching_keys:
-            merged_books = books1.union(*[author_dict[key] for key in matching_keys])  # Объединяет множества книг
-            for key in matching_keys:
-                del author_dict[key]  # Удаляет совпадающие ключи из исходного словаря
-            merged_dict[key1] = merged_books  # Добавляет объединенное множество в новый словарь
+    groups = {}  # Сигнатура -> (канонический ключ, множество книг)
+    for key in reversed(author_dict):
+        books = author_dict[key]
+        signature = signature_of(key)
+        if signature in groups:
+            groups[signature][1].update(books)  # Добавляет книги в группу с совпадающими фамилиями
         else:
-            merged_dict[key1] = books1  # Если совпадений нет, добавляет множество в новый словарь
+            groups[signature] = (key, set(books))
+    author_dict.clear()
+
+    return {key: books for key, books in groups.values()}  # Возвращает объединенный словарь авторов
+
 
-    return merged_dict  # Возвращает объединенный словарь авторов
+def author_groups(keys, merged_dict, signature_of=author_signature):
+    # Сопоставляет ключи авторов до объединения с папками групп, полученными в compare_and_merge_keys.
+    # Принимает список `keys` - ключи словаря авторов, словарь `merged_dict` - объединенный словарь авторов
+    # и `signature_of` - функция сигнатуры, с которой выполнялось объединение.
+    # Возвращает словарь "ключ автора -> ключ группы".
 
+    canonical = {signature_of(key): key for key in merged_dict}
+    return {key: canonical[signature_of(key)] for key in keys if signature_of(key) in canonical}
 
-def organize_books_by_author(merged_dict, base_folder='books'):
+
+def organize_books_by_author(merged_dict, base_folder='books', path_index=None):
     # Организует книги по авторам в структуру папок, создавая папки для каждого автора и перемещая файлы.
-    # Принимает словарь `merged_dict` - объединенный словарь авторов и `base_folder` - базовая папка.
+    # Принимает словарь `merged_dict` - объединенный словарь авторов, `base_folder` - базовая папка
+    # и словарь `path_index` - индекс путей к книгам (если не передан, строится одним обходом папки).
+
+    plan = MovePlan()
+    plan_books_by_author(merged_dict, plan, base_folder=base_folder, path_index=path_index)
+    plan.execute()  # Перемещает файлы в папки авторов
 
-    os.makedirs(base_folder, exist_ok=True)  # Создает базовую папку, если её нет
+
+def plan_books_by_author(merged_dict, plan, sources=None, base_folder='books', path_index=None):
+    # Добавляет в план перемещения книг в папки авторов; файловая система не изменяется.
+    # Книга, которая заняла бы путь уже существующего файла, в план не попадает.
+    # Принимает словарь `merged_dict` - объединенный словарь авторов, `plan` - объект MovePlan,
+    # словарь `sources` - текущие пути новых книг по новым именам, `base_folder` - базовая папка
+    # и словарь `path_index` - индекс путей к книгам библиотеки (если не передан, строится одним обходом папки).
+
+    if path_index is None:
+        path_index = build_path_index(base_folder)
+    sources = sources or {}
+    existing = set(path_index.values())
     for authors, books in merged_dict.items():
         author_folder = os.path.join(base_folder, authors)  # Формирует путь к папке автора
-        os.makedirs(author_folder, exist_ok=True)  # Создает папку автора, если её нет
         for book in books:
-            source_path = find_book_path('books', book)  # Находит путь к исходному файлу
+            source_path = sources.get(book) or path_index.get(book)  # Находит путь к исходному файлу
             destination_path = os.path.join(author_folder, book)  # Формирует путь к целевому файлу
-            if source_path and source_path != destination_path:
-                try:
-                    shutil.move(source_path, destination_path)  # Перемещает файл в папку автора
-                # print(f"Moved '{book}' to '{author_folder}'")
-                except Exception as e:
-                    print(f"Error moving '{book}': {e}")  # Выводит сообщение об ошибке, если что-то идет не так
+            if not source_path or source_path == destination_path:
+                continue
+            if destination_path in existing:
+                print(f"Error moving '{book}': '{destination_path}' already exists")
+            else:
+                plan.add(source_path, destination_path)
 
 
-def find_book_path(base_folder, book):
-    # Находит полный путь к файлу `book` в структуре папок, начиная с базовой папки.
-    # Принимает строку `base_folder` - базовая папка и строку `book` - имя файла.
-    # Возвращает строку - полный путь к файлу или None, если файл не найден.
+def build_path_index(base_folder):
+    # Строит индекс "имя файла -> путь" за один обход структуры папок.
+    # При совпадении имен сохраняется первый найденный путь.
+    # Принимает строку `base_folder` - базовая папка.
+    # Возвращает словарь - индекс путей к файлам.
 
+    path_index = {}
     for root, dirs, files in os.walk(base_folder):
-        if book in files:
-            return os.path.join(root, book)  # Возвращает полный путь к файлу
-    return None  # Возвращает None, если файл не найден
+        for file in files:
+            path_index.setdefault(file, os.path.join(root, file))
+    return path_index
 
 
 def create_author_dict(folder_author):
@@ -205,26 +421,139 @@ def remove_empty_folders(base_folder='books'):
                     print(f"Error removing empty folder {author_folder}: {e}")
 
 
-def process_books_in_folder(folder):
-    # Обрабатывает книги в указанной папке, создавая и организуя структуру файлов и папок.
+def list_book_files(folder):
+    # Возвращает список путей к файлам книг верхнего уровня указанной папки.
     # Принимает `folder` - путь к папке с книгами.
 
-    author_dict = create_author_dict(folder)  # Создает словарь авторов на основе файлов в папке
-    for file in os.listdir(folder):
-        try:
-            if file == 'output.fb2':
-                continue
-            if re.fullmatch(r'.*\.epub', file):
-                process_epub(os.path.join(folder, file), author_dict)  # Обрабатывает EPUB
-            elif re.fullmatch(r'.*\.fb2', file):
-                process_fb2(os.path.join(folder, file), author_dict)  # Обрабатывает FB2
-        except Exception as e:
-            print(f"Error processing {file}: {e}")
-
-    merged_author_dict = compare_and_merge_keys(author_dict)  # Сравнивает и объединяет авторов
-    organize_books_by_author(merged_author_dict)  # Организует книги по авторам
-    create_fb2_file(merged_author_dict, ns_output)  # Создает файл формата FB2
-    remove_empty_folders()  # Удаляет пустые папки
+    return [os.path.join(folder, file) for file in os.listdir(folder)
+            if file != 'output.fb2' and re.fullmatch(r'.*\.(epub|fb2|fb2\.zip)', file)]
+
+
+def ingest_files(files, author_dict, cache, plan, workers=1, taken=None, quarantine=True):
+    # Извлекает метаданные файлов (параллельно, с использованием кэша), отсеивает побайтные дубликаты,
+    # назначает файлам новые имена и добавляет их в словарь авторов. Файлы не перемещаются:
+    # перемещение в папку автора и в карантин добавляется в план.
+    # Принимает список `files` - пути к файлам, словарь `author_dict` - словарь авторов,
+    # `cache` - объект MetadataCache, `plan` - объект MovePlan, `workers` - число процессов,
+    # множество `taken` - занятые имена файлов (по умолчанию все книги из `author_dict`)
+    # и `quarantine` - перемещать дубликаты в папку карантина (иначе только сообщать о них).
+    # Возвращает словарь "новое имя файла -> запись метаданных" для обработанных книг;
+    # первый элемент записи - текущий путь к файлу.
+
+    if taken is None:
+        taken = set().union(*author_dict.values())
+    # Первая стадия: параллельное извлечение метаданных (неизмененные файлы берутся из кэша)
+    with instrumentation.phase('read_metadata') as phase:
+        records = [record for record in extract_metadata_cached(files, cache, workers) if record is not None]
+        phase.items = len(files)
+    with instrumentation.phase('deduplicate') as phase:
+        deduplicator = Deduplicator(cache)
+        duplicates = deduplicator.find_duplicates([record[0] for record in records])
+        phase.items = len(records)
+    instrumentation.count('bytes_hashed', deduplicator.bytes_hashed)
+    instrumentation.count('duplicates', len(duplicates))
+
+    processed = {}
+    with instrumentation.phase('process_common') as phase:
+        phase.items = len(records)
+        for record in records:
+            original = duplicates.get(os.path.abspath(record[0]))
+            try:
+                if original is None:
+                    new_name = apply_metadata(record, author_dict, taken)  # Вторая стадия: имена
+                    processed[new_name] = record
+                elif quarantine:
+                    destination = quarantine_destination(record[0], duplicates_folder, plan.destinations)
+                    plan.add(record[0], destination)
+                    print(f"Duplicate '{os.path.basename(record[0])}' of '{original}' moved to '{destination}'")
+                else:
+                    print(f"Duplicate '{os.path.basename(record[0])}' of '{original}'")
+            except Exception as e:
+                print(f"Error processing {os.path.basename(record[0])}: {e}")
+    if duplicates:
+        print(f"Duplicates: {len(duplicates)} found, {deduplicator.bytes_hashed} bytes hashed")
+    return processed
+
+
+def remember_filed_books(cache, merged_author_dict, processed):
+    # Сохраняет в кэше итоговые пути обработанных книг в папках авторов вместо исходных путей.
+    # Принимает `cache` - объект MetadataCache, словарь `merged_author_dict` - объединенный словарь авторов
+    # и словарь `processed` - результат ingest_files.
+
+    for authors, books in merged_author_dict.items():
+        for book in books & processed.keys():
+            cache.forget(os.path.abspath(processed[book][0]))
+            book_path = os.path.abspath(os.path.join('books', authors, book))
+            if os.path.isfile(book_path):
+                cache.put(book_path, os.stat(book_path), processed[book], book)  # Запоминает итоговый путь книги
+
+
+def process_books_in_folder(folder, workers=1, full=False, quarantine=True, dry_run=False, rollback=False, fs=None):
+    # Обрабатывает книги в указанной папке, создавая и организуя структуру файлов и папок.
+    # Все перемещения сначала собираются в план (каждая книга перемещается один раз, сразу в папку автора),
+    # план записывается в журнал и выполняется пакетами.
+    # Принимает `folder` - путь к папке с книгами, `workers` - число процессов для извлечения метаданных,
+    # `full` - полная пересборка каталога, `quarantine` - перемещать дубликаты в папку карантина,
+    # `dry_run` - только напечатать план, `rollback` - откатить прерванный план вместо его повторения
+    # и `fs` - объект AsyncFS для асинхронного режима: обращения к файловой системе при чтении папок,
+    # перемещениях, проверке ссылок и удалении пустых папок выполняются одновременно.
+    # Возвращает словарь - объединенный словарь авторов библиотеки (пустой после отката).
+
+    recover_journal(move_journal_file, rollback, dry_run)  # Завершает план, прерванный при прошлом запуске
+    if rollback:
+        if not dry_run:
+            remove_empty_folders()  # Папки, созданные прерванным планом
+        return {}  # Откат - отдельная операция: возвращенные книги не раскладываются заново в том же запуске
+    with instrumentation.phase('create_author_dict'):
+        # Создает словарь авторов на основе файлов в папке
+        author_dict = create_author_dict(folder) if fs is None else fs.run(fs.create_author_dict(folder))
+        files = list_book_files(folder)
+        path_index = build_path_index('books') if fs is None else fs.run(fs.build_path_index('books'))
+    cache = MetadataCache(metadata_cache_file, read_only=dry_run)
+    # Книги, разложенные до появления поиска дубликатов, тоже участвуют в сравнении
+    cache.add_library_files(path for path in path_index.values() if os.path.dirname(os.path.dirname(path)))
+    plan = MovePlan()
+    processed = ingest_files(files, author_dict, cache, plan, workers, quarantine=quarantine)
+
+    keys = list(author_dict)
+    aliases = AuthorAliases(author_aliases_file, read_only=dry_run)
+    with instrumentation.phase('compare_and_merge_keys') as phase:
+        phase.items = len(author_dict)
+        aliases.learn(keys)  # Канонизирует новые имена авторов
+        merged_author_dict = compare_and_merge_keys(author_dict, aliases.signature)  # Сравнивает и объединяет авторов
+    with instrumentation.phase('plan_moves'):
+        sources = {book: record[0] for book, record in processed.items()}
+        plan_books_by_author(merged_author_dict, plan, sources, path_index=path_index)  # Планирует раскладку книг
+    if dry_run:
+        plan.print()
+        cache.close()
+        aliases.close()
+        return merged_author_dict
+    with instrumentation.phase('organize_books_by_author') as phase:
+        phase.items = len(plan)
+        plan.execute(move_journal_file, fs=fs)  # Организует книги по авторам
+    with instrumentation.phase('create_fb2_file'):
+        create_fb2_file(merged_author_dict, ns_output, full=full, fs=fs)  # Создает файл формата FB2
+    with instrumentation.phase('remove_empty_folders'):
+        if fs is None:
+            remove_empty_folders()  # Удаляет пустые папки
+        else:
+            fs.run(fs.remove_empty_folders())
+
+    with instrumentation.phase('metadata_cache'):
+        remember_filed_books(cache, merged_author_dict, processed)
+        pruned = cache.prune()  # Удаляет записи об исчезнувших файлах
+    print(f"Metadata cache: {cache.hits} hits, {cache.misses} misses, {pruned} pruned")
+    instrumentation.count('cache_hits', cache.hits)
+    instrumentation.count('cache_misses', cache.misses)
+    cache.close()
+
+    with instrumentation.phase('library_index'):
+        index = LibraryIndex(library_index_file)
+        index.update(merged_author_dict, processed, author_groups(keys, merged_author_dict, aliases.signature),
+                     full=True)
+        index.close()
+    aliases.close()
 
     # print("----- Merged Author Dictionary -----")
     # for authors, books in merged_author_dict.items():
@@ -232,8 +561,86 @@ def process_books_in_folder(folder):
     #     for book in books:
     #         print(f"  - {book}")
     # print(merged_author_dict)
+    return merged_author_dict
+
+
+def parse_args(argv=None):
+    # Разбирает аргументы командной строки.
+    # Принимает список `argv` (по умолчанию sys.argv).
+    # Возвращает объект argparse.Namespace.
+
+    parser = argparse.ArgumentParser(description='Организация библиотеки EPUB и FB2 по авторам.')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='число процессов для извлечения метаданных (по умолчанию 1)')
+    parser.add_argument('--full', action='store_true',
+                        help='полностью пересобрать каталог output.fb2')
+    parser.add_argument('--report-duplicates', action='store_true',
+                        help='только сообщать о дубликатах, не перемещая их в папку карантина')
+    parser.add_argument('--watch', action='store_true',
+                        help='после первого прохода наблюдать за папкой и обрабатывать новые книги пакетами')
+    parser.add_argument('--report', nargs='?', const='run_report.json',
+                        help='замерять фазы и записать отчет в JSON (по умолчанию run_report.json)')
+    parser.add_argument('--slowest', type=int, default=10, help='число самых медленных файлов в отчете')
+    parser.add_argument('--profile', help='записать статистику cProfile в файл (включает --report)')
+    parser.add_argument('--trace-memory', action='store_true',
+                        help='замерять пик памяти Python по фазам через tracemalloc (включает --report)')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='только напечатать план перемещений, не изменяя библиотеку')
+    parser.add_argument('--rollback', action='store_true',
+                        help='откатить перемещения, прерванные при прошлом запуске, вместо их завершения')
+    parser.add_argument('--async-io', type=int, metavar='N',
+                        help='выполнять до N обращений к файловой системе одновременно (для сетевых дисков)')
+    parser.add_argument('--io-latency', type=float, default=0.0, metavar='MS',
+                        help='искусственная задержка каждого обращения в режиме --async-io, мс (для проверки)')
+    parser.add_argument('--search', metavar='QUERY',
+                        help='найти книги по словам из названия, авторов и серии и завершить работу')
+    parser.add_argument('--author', help='вывести книги автора (с учетом объединенных групп) и завершить работу')
+    parser.add_argument('--limit', type=int, default=20, help='наибольшее число результатов --search')
+    return parser.parse_args(argv)
+
+
+def print_books(books):
+    # Печатает найденные книги: путь, серия, год и ISBN.
+    # Принимает список `books` - результат LibraryIndex.search или LibraryIndex.books_by_author.
+
+    for book in books:
+        details = ', '.join(str(value) for value in (book['series'], book['year'], book['isbn']) if value)
+        print(f"{book['path']}" + (f" ({details})" if details else ''))
+    print(f"Found: {len(books)}")
 
 
 if __name__ == "__main__":
+    args = parse_args()
     folder_path = os.path.join(os.getcwd(), 'Books')  # Формирует путь к папке с книгами
-    process_books_in_folder(folder_path)  # Вызывает функцию обработки книг в указанной папке
+    quarantine = not args.report_duplicates
+    if args.profile or args.trace_memory:
+        args.report = args.report or 'run_report.json'
+    if args.report:
+        instrumentation.enable(slowest=args.slowest, trace_memory=args.trace_memory, profile_path=args.profile)
+    fs = AsyncFS(args.async_io, args.io_latency / 1000) if args.async_io else None
+    if args.search or args.author:
+        index = LibraryIndex(library_index_file)
+        if args.search:
+            print_books(index.search(args.search, args.limit))
+        else:
+            aliases = AuthorAliases(author_aliases_file, read_only=True)  # Имя автора в любой записи
+            print_books(index.books_by_author(args.author, aliases.signature))
+            aliases.close()
+        index.close()
+    elif args.watch and not args.dry_run:
+        from watch import watch_folder
+        try:
+            # Обрабатывает новые книги по мере поступления
+            watch_folder(folder_path, args.workers, args.full, quarantine, args.rollback, fs)
+        except KeyboardInterrupt:
+            print("Stopped watching")
+        finally:
+            if args.report:
+                instrumentation.current.finish(args.report)  # Отчет за все время наблюдения
+    else:
+        # Обрабатывает книги в папке
+        process_books_in_folder(folder_path, args.workers, args.full, quarantine, args.dry_run, args.rollback, fs)
+        if args.report:
+            instrumentation.current.finish(args.report)  # Записывает отчет и печатает сводку
+    if fs is not None:
+        fs.close()
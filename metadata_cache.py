@@ -0,0 +1,186 @@
+# Модуль постоянного кэша метаданных книг на основе SQLite.
+
+import json
+import os
+import pathlib
+import sqlite3
+
+
+class MetadataCache:
+    # Кэш извлеченных метаданных, ключ - (путь, размер, mtime_ns) с запасным поиском по inode.
+    # Неизмененные файлы не открываются и не разбираются повторно.
+
+    def __init__(self, db_path, read_only=False):
+        # Открывает (или создает) базу кэша.
+        # Принимает `db_path` - путь к файлу SQLite и `read_only` - не сохранять изменения (для --dry-run):
+        # записи видны до закрытия базы, а при закрытии отменяются; отсутствующая база не создается.
+
+        self.read_only = read_only
+        self.connection = open_database(db_path, read_only)
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS metadata ('
+            'path TEXT PRIMARY KEY, dev INTEGER, inode INTEGER, size INTEGER, mtime_ns INTEGER, '
+            'format TEXT, title TEXT, authors TEXT, target TEXT, details TEXT)')
+        columns = [row[1] for row in self.connection.execute('PRAGMA table_info(metadata)')]
+        if 'details' not in columns:  # База, созданная до появления дополнительных метаданных
+            self.connection.execute('ALTER TABLE metadata ADD COLUMN details TEXT')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS metadata_inode ON metadata (dev, inode)')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS metadata_size ON metadata (size)')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS library_files ('
+            'path TEXT PRIMARY KEY, dev INTEGER, inode INTEGER, size INTEGER, mtime_ns INTEGER)')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS library_files_size ON library_files (size)')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS digests ('
+            'dev INTEGER, inode INTEGER, size INTEGER, mtime_ns INTEGER, partial TEXT, digest TEXT, '
+            'PRIMARY KEY (dev, inode, size, mtime_ns))')
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, file, stat):
+        # Возвращает запись (путь, формат, заголовок, список авторов, дополнительные метаданные)
+        # для неизмененного файла.
+        # Принимает `file` - путь к файлу и `stat` - результат os.stat для него.
+        # Возвращает запись, False для файла, который ранее не удалось прочитать, или None при промахе.
+
+        row = self.connection.execute(
+            'SELECT size, mtime_ns, format, title, authors, details FROM metadata WHERE path = ?',
+            (file,)).fetchone()
+        if row is None or row[:2] != (stat.st_size, stat.st_mtime_ns):
+            # Файл мог быть перемещен: ищет тот же inode с тем же размером и временем изменения
+            row = self.connection.execute(
+                'SELECT size, mtime_ns, format, title, authors, details FROM metadata '
+                'WHERE dev = ? AND inode = ? AND size = ? AND mtime_ns = ?',
+                (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        format_type, title, authors, details = row[2:]
+        if format_type is None:
+            return False  # Файл без читаемых метаданных
+        return file, format_type, title, json.loads(authors), json.loads(details) if details else {}
+
+    def put(self, file, stat, record, target=None):
+        # Сохраняет метаданные файла.
+        # Принимает `file` - путь, `stat` - результат os.stat, `record` - запись метаданных или None
+        # для нечитаемого файла и `target` - итоговое имя файла.
+
+        format_type, title, authors, details = (
+            record[1], record[2], json.dumps(record[3], ensure_ascii=False), json.dumps(record[4], ensure_ascii=False)
+        ) if record else (None, None, None, None)
+        self.connection.execute(
+            'INSERT OR REPLACE INTO metadata (path, dev, inode, size, mtime_ns, format, title, authors, target, details) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (file, stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns, format_type, title, authors, target,
+             details))
+
+    def add_library_files(self, paths):
+        # Запоминает размер файлов библиотеки, о которых в кэше еще нет записей (книги, разложенные
+        # до появления поиска дубликатов), чтобы они участвовали в поиске копий.
+        # Принимает `paths` - пути к файлам в папках авторов.
+        # Возвращает число добавленных файлов.
+
+        known = {row[0] for row in self.connection.execute(
+            'SELECT path FROM metadata UNION SELECT path FROM library_files')}
+        rows = []
+        for path in map(os.path.abspath, paths):
+            if path in known:
+                continue
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            rows.append((path, stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns))
+        self.connection.executemany('INSERT OR REPLACE INTO library_files VALUES (?, ?, ?, ?, ?)', rows)
+        return len(rows)
+
+    def files_of_size(self, size):
+        # Возвращает пути известных файлов библиотеки указанного размера.
+        # Принимает `size` - размер в байтах.
+
+        return [row[0] for row in self.connection.execute(
+            'SELECT path FROM metadata WHERE size = ? UNION SELECT path FROM library_files WHERE size = ?',
+            (size, size))]
+
+    def get_digests(self, stat):
+        # Возвращает сохраненные хеши файла - (частичный, полный), отсутствующие значения равны None.
+        # Ключ не зависит от пути, поэтому хеши сохраняются при переименовании и перемещении файла.
+        # Принимает `stat` - результат os.stat для файла.
+
+        row = self.connection.execute(
+            'SELECT partial, digest FROM digests WHERE dev = ? AND inode = ? AND size = ? AND mtime_ns = ?',
+            (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns)).fetchone()
+        return row if row else (None, None)
+
+    def put_digests(self, stat, partial, digest):
+        # Сохраняет хеши файла.
+        # Принимает `stat` - результат os.stat, `partial` - частичный хеш и `digest` - полный хеш (или None).
+
+        self.connection.execute(
+            'INSERT OR REPLACE INTO digests VALUES (?, ?, ?, ?, ?, ?)',
+            (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns, partial, digest))
+
+    def forget(self, file):
+        # Удаляет запись о файле.
+        # Принимает `file` - путь к файлу.
+
+        self.connection.execute('DELETE FROM metadata WHERE path = ?', (file,))
+
+    def rename_folder(self, old, new):
+        # Переносит записи о файлах переименованной папки на новые пути.
+        # Принимает строки `old` и `new` - прежний и новый пути к папке.
+
+        old, new = os.path.join(os.path.abspath(old), ''), os.path.join(os.path.abspath(new), '')
+        for table in ('metadata', 'library_files'):
+            self.connection.execute(
+                f'UPDATE OR REPLACE {table} SET path = ? || substr(path, ?) WHERE substr(path, 1, ?) = ?',
+                (new, len(old) + 1, len(old), old))
+
+    def prune(self):
+        # Удаляет записи о файлах, которых больше нет на диске.
+        # Возвращает число удаленных записей.
+
+        paths = [row[0] for row in self.connection.execute('SELECT path FROM metadata')]
+        missing = [(path,) for path in paths if not os.path.exists(path)]
+        self.connection.executemany('DELETE FROM metadata WHERE path = ?', missing)
+        library_paths = [row[0] for row in self.connection.execute('SELECT path FROM library_files')]
+        self.connection.executemany('DELETE FROM library_files WHERE path = ?',
+                                    [(path,) for path in library_paths if not os.path.exists(path)])
+        self.connection.execute(
+            'DELETE FROM digests WHERE NOT EXISTS (SELECT 1 FROM metadata AS known WHERE known.dev = digests.dev AND '
+            'known.inode = digests.inode AND known.size = digests.size AND known.mtime_ns = digests.mtime_ns) '
+            'AND NOT EXISTS (SELECT 1 FROM library_files AS known WHERE known.dev = digests.dev AND '
+            'known.inode = digests.inode AND known.size = digests.size AND '
+            'known.mtime_ns = digests.mtime_ns)')  # Хеши файлов, которых больше нет в библиотеке
+        return len(missing)
+
+    def close(self):
+        # Сохраняет изменения (в режиме `read_only` - отменяет) и закрывает базу.
+
+        if self.read_only:
+            self.connection.rollback()
+        else:
+            self.connection.commit()
+        self.connection.close()
+
+
+def open_database(db_path, read_only=False):
+    # Открывает базу SQLite, создавая ее папку.
+    # В режиме `read_only` файл открывается только для чтения и копируется в память: таблицы и записи,
+    # созданные после открытия, видны до закрытия соединения, но в файл не попадают; отсутствующая база не создается.
+    # Принимает `db_path` - путь к файлу SQLite и `read_only` - не изменять файл.
+    # Возвращает объект sqlite3.Connection.
+
+    if read_only:
+        connection = sqlite3.connect(':memory:')
+        if os.path.exists(db_path):
+            source = sqlite3.connect(f'{pathlib.Path(db_path).resolve().as_uri()}?mode=ro', uri=True)
+            source.backup(connection)
+            source.close()
+        return connection
+    folder = os.path.dirname(db_path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    return sqlite3.connect(db_path)
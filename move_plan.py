@@ -0,0 +1,180 @@
+# Модуль плана перемещений файлов: план строится в памяти, записывается в журнал и выполняется пакетами.
+# Незавершенный журнал при следующем запуске повторяется или откатывается.
+
+import errno
+import json
+import os
+import shutil
+
+
+class MovePlan:
+    # План перемещений "исходный путь -> итоговый путь".
+    # Совпадения итоговых путей отсекаются при добавлении, до любых изменений на диске.
+
+    def __init__(self):
+        self.moves = []
+        self.destinations = set()
+
+    def __len__(self):
+        return len(self.moves)
+
+    def add(self, source, destination):
+        # Добавляет перемещение в план.
+        # Принимает строки `source` и `destination` - исходный и итоговый пути.
+        # Возвращает False, если итоговый путь уже занят другим перемещением плана.
+
+        if destination in self.destinations:
+            print(f"Error planning '{source}': '{destination}' is already a destination")
+            return False
+        self.destinations.add(destination)
+        self.moves.append((source, destination))
+        return True
+
+    def print(self):
+        # Печатает план перемещений.
+
+        for source, destination in self.moves:
+            print(f"{source} -> {destination}")
+        print(f"Planned moves: {len(self.moves)}")
+
+    def execute(self, journal_path=None, batch_size=500, fs=None):
+        # Выполняет план пакетами по `batch_size` перемещений: сначала весь план записывается в журнал,
+        # после каждого пакета в журнал добавляется отметка о выполнении. Каждая папка создается один раз.
+        # Принимает `journal_path` - путь к файлу журнала (None - без журнала), `batch_size` - размер пакета
+        # и `fs` - объект AsyncFS, чтобы перемещения пакета выполнялись одновременно
+        # (только для планов из перемещений файлов: переименование папки должно предшествовать перемещениям в нее).
+        # Возвращает число выполненных перемещений.
+
+        if not self.moves:
+            return 0
+        journal = open_journal(journal_path, self.moves) if journal_path else None
+        folders = set()  # Уже созданные папки
+        moved = 0
+        for start in range(0, len(self.moves), batch_size):
+            batch = self.moves[start:start + batch_size]
+            if fs is None:
+                results = [move_into_folder(source, destination, folders) for source, destination in batch]
+            else:
+                results = fs.run(fs.execute_moves(batch, folders))
+            for (source, destination), error in zip(batch, results):
+                if error is None:
+                    moved += 1
+                else:
+                    print(f"Error moving '{source}': {error}")  # Выводит сообщение об ошибке, если что-то идет не так
+            if journal:
+                write_record(journal, {'done': min(start + batch_size, len(self.moves))})
+        if journal:
+            journal.close()
+            os.remove(journal_path)  # План выполнен полностью
+        return moved
+
+
+def move_into_folder(source, destination, folders):
+    # Перемещает файл, создавая папку назначения, если ее нет в множестве уже созданных папок `folders`.
+    # Возвращает None или исключение, если перемещение не удалось.
+
+    folder = os.path.dirname(destination)
+    try:
+        if folder not in folders:
+            os.makedirs(folder, exist_ok=True)
+            folders.add(folder)
+        move_path(source, destination)
+    except Exception as e:
+        return e
+    return None
+
+
+def move_path(source, destination):
+    # Перемещает файл или папку: в пределах одной файловой системы - одним os.replace,
+    # между файловыми системами - через shutil.move с копированием.
+    # Принимает строки `source` и `destination`.
+
+    try:
+        os.replace(source, destination)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        shutil.move(source, destination)
+
+
+def open_journal(journal_path, moves):
+    # Создает журнал и записывает в него план; журнал дописывается только в конец.
+    # Отметка 'planned' в конце плана означает, что план записан целиком.
+    # Принимает `journal_path` - путь к журналу и список `moves` - перемещения плана.
+    # Возвращает открытый файл журнала.
+
+    folder = os.path.dirname(journal_path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    journal = open(journal_path, 'a', encoding='utf-8')
+    for source, destination in moves:
+        journal.write(json.dumps({'move': [source, destination]}, ensure_ascii=False) + '\n')
+    write_record(journal, {'planned': len(moves)})
+    return journal
+
+
+def write_record(journal, record):
+    # Дописывает запись в журнал и сбрасывает ее на диск.
+
+    journal.write(json.dumps(record) + '\n')
+    journal.flush()
+    os.fsync(journal.fileno())
+
+
+def read_journal(journal_path):
+    # Читает журнал.
+    # Принимает `journal_path` - путь к журналу.
+    # Возвращает кортеж (список перемещений, план записан целиком, число выполненных перемещений).
+    # Оборванная при сбое последняя строка пропускается.
+
+    moves, planned, done = [], False, 0
+    with open(journal_path, encoding='utf-8') as journal:
+        for line in journal:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break
+            if 'move' in record:
+                moves.append(tuple(record['move']))
+            elif 'planned' in record:
+                planned = True
+            elif 'done' in record:
+                done = record['done']
+    return moves, planned, done
+
+
+def recover_journal(journal_path, rollback=False, dry_run=False):
+    # Завершает прерванное выполнение плана: повторяет невыполненные перемещения или (`rollback`)
+    # возвращает выполненные на место. Перемещения проверяются по диску, поэтому восстановление
+    # можно безопасно прервать и запустить снова.
+    # Если план не был записан целиком, ни одно перемещение не выполнялось, и журнал просто удаляется.
+    # Принимает `journal_path` - путь к журналу, `rollback` - откатить вместо повторения
+    # и `dry_run` - только напечатать действия.
+    # Возвращает число выполненных (или напечатанных) перемещений; 0, если журнала нет.
+
+    if not os.path.exists(journal_path):
+        return 0
+    moves, planned, done = read_journal(journal_path)
+    if planned:
+        print(f"Interrupted move journal: {done} of {len(moves)} moves were done")
+    else:
+        moves = []
+    if rollback:
+        moves = [(destination, source) for source, destination in reversed(moves)]
+    count = 0
+    for source, destination in moves:
+        if not os.path.exists(source) or os.path.exists(destination):
+            continue  # Перемещение уже выполнено (или файла больше нет)
+        count += 1
+        if dry_run:
+            print(f"{source} -> {destination}")
+            continue
+        try:
+            os.makedirs(os.path.dirname(destination) or '.', exist_ok=True)
+            move_path(source, destination)
+        except Exception as e:
+            print(f"Error moving '{source}': {e}")
+    if not dry_run:
+        os.remove(journal_path)
+        print(f"Move journal {'rolled back' if rollback else 'replayed'}: {count} moves")
+    return count
@@ -0,0 +1,35 @@
+# Проверки асинхронного режима: результаты должны совпадать с последовательными функциями main.
+
+import os
+
+import pytest
+
+from async_fs import AsyncFS
+from main import build_path_index, create_author_dict
+
+
+@pytest.fixture
+def library(tmp_path, monkeypatch):
+    # Библиотека со ссылкой на папку автора вне библиотеки, ссылкой на файл и ссылкой-петлей на родительскую папку.
+
+    monkeypatch.chdir(tmp_path)
+    for path in ['books/A/x.fb2', 'books/A/B/y.fb2', 'books/top.fb2', 'outside/C/z.fb2']:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        open(path, 'w').close()
+    os.symlink('..', 'books/A/up')
+    os.symlink('x.fb2', 'books/A/link.fb2')
+    os.symlink(os.path.join('..', 'outside', 'C'), 'books/C')
+    fs = AsyncFS(4)
+    yield fs
+    fs.close()
+
+
+def test_create_author_dict(library):
+    assert library.run(library.create_author_dict('books')) == create_author_dict('books')
+    assert create_author_dict('books')['C'] == {'z.fb2'}
+
+
+def test_walk_does_not_follow_links(library):
+    assert [root for root, folders, files in library.run(library.walk('books'))] == \
+        [root for root, folders, files in os.walk('books')]
+    assert library.run(library.build_path_index('books')) == build_path_index('books')
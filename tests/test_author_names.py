@@ -0,0 +1,100 @@
+# Проверки канонизации имен авторов на парах, которые должны и не должны объединяться.
+
+import pytest
+
+from author_names import AuthorAliases, skeleton, similar_surnames
+from main import compare_and_merge_keys
+
+
+@pytest.fixture
+def aliases(tmp_path):
+    table = AuthorAliases(str(tmp_path / 'aliases.sqlite'))
+    yield table
+    table.close()
+
+
+def merged_keys(aliases, keys):
+    # Возвращает группы ключей после объединения (множество frozenset ключей).
+
+    aliases.learn(keys)
+    signatures = {key: aliases.signature(key) for key in keys}
+    merged = compare_and_merge_keys({key: {key} for key in keys}, aliases.signature)
+    return {frozenset(books) for books in merged.values()}, signatures
+
+
+@pytest.mark.parametrize('first, second', [
+    ('Толстой', 'Tolstoy'), ('Толстой', 'Tolstoi'), ('Достоевский', 'Dostoyevsky'), ('Чехов', 'Chekhov'),
+    ('Чехов', 'Tchekhov'), ('Маяковский', 'Mayakovsky'), ('Салтыков-Щедрин', 'Saltykov-Shchedrin'), ('Ёлкин', 'Елкин'),
+])
+def test_same_skeleton(first, second):
+    assert skeleton(first) == skeleton(second)
+
+
+@pytest.mark.parametrize('first, second', [('Маяковский', 'Маковский'), ('Леев', 'Лев'), ('Петров', 'Петрова')])
+def test_different_surnames(first, second):
+    assert skeleton(first) != skeleton(second)
+    assert not similar_surnames(skeleton(first), skeleton(second))
+
+
+def test_word_order_on_fresh_table(aliases):
+    groups, signatures = merged_keys(aliases, ['Лев Толстой', 'Толстой Лев'])
+    assert groups == {frozenset(['Лев Толстой', 'Толстой Лев'])}
+
+
+def test_spellings_of_one_author(aliases):
+    keys = ['Лев Толстой', 'Толстой Лев', 'Leo Tolstoy', 'L. Tolstoy', 'Лев Николаевич Толстой', 'Tolstoy L.']
+    groups, signatures = merged_keys(aliases, keys)
+    assert groups == {frozenset(keys)}
+
+
+def test_different_authors_are_not_merged(aliases):
+    keys = ['Борис Леев', 'Лев Толстой', 'Толстой Лев', 'Алексей Толстой', 'Владимир Маяковский', 'Сергей Маковский',
+            'Иван Петров', 'Анна Петрова']
+    groups, signatures = merged_keys(aliases, keys)
+    assert groups == {frozenset(['Лев Толстой', 'Толстой Лев']), frozenset(['Борис Леев']),
+                      frozenset(['Алексей Толстой']), frozenset(['Владимир Маяковский']),
+                      frozenset(['Сергей Маковский']), frozenset(['Иван Петров']), frozenset(['Анна Петрова'])}
+
+
+def test_surname_alone_joins_the_only_author(aliases):
+    keys = ['Лев Толстой', 'Толстой', 'Tolstoy', 'Чехов', 'Антон Павлович Чехов, Иван Бунин', 'Бунин']
+    groups, signatures = merged_keys(aliases, keys)
+    assert groups == {frozenset(keys[:3]), frozenset(keys[3:4]), frozenset(keys[4:5]), frozenset(keys[5:])}
+
+
+def test_surname_alone_with_several_authors(aliases):
+    keys = ['Лев Толстой', 'Алексей Толстой', 'Толстой']
+    groups, signatures = merged_keys(aliases, keys)
+    assert groups == {frozenset([key]) for key in keys}
+
+
+def test_transliteration_variants(aliases):
+    keys = ['Иван Тургенев', 'Ivan Turgenev', 'Ivan Turgeniev', 'Fyodor Dostoevsky', 'Фёдор Достоевский',
+            'Fedor Dostoevskij', 'Михаил Булгаков, Антон Чехов', 'Anton Chekhov, Mikhail Bulgakov']
+    groups, signatures = merged_keys(aliases, keys)
+    assert groups == {frozenset(keys[:3]), frozenset(keys[3:6]), frozenset(keys[6:])}
+
+
+def test_unsure_order_is_revisited(tmp_path):
+    path = str(tmp_path / 'aliases.sqlite')
+    aliases = AuthorAliases(path)
+    aliases.learn(['Бендер Остап'])  # Оба слова неизвестны: фамилией выбрано последнее слово
+    aliases.close()
+
+    aliases = AuthorAliases(path)
+    aliases.learn(['Остап Бендер', 'Киса Бендер'])
+    assert aliases.signature('Бендер Остап') == aliases.signature('Остап Бендер')
+    aliases.close()
+
+
+def test_decisions_are_reused(tmp_path):
+    path = str(tmp_path / 'aliases.sqlite')
+    aliases = AuthorAliases(path)
+    aliases.learn(['Ivan Turgenev', 'Ivan Turgeniev'])
+    signature = aliases.signature('Ivan Turgeniev')
+    aliases.close()
+
+    aliases = AuthorAliases(path)
+    assert aliases.names and aliases.signature('Ivan Turgeniev') == signature
+    assert aliases.signature('Иван Тургенев') == signature
+    aliases.close()
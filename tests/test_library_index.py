@@ -0,0 +1,34 @@
+# Проверки поиска книг автора в поисковом индексе.
+
+import pytest
+
+from author_names import AuthorAliases
+from library_index import LibraryIndex
+
+BOOKS = {'Михаил Шевко': {'«Первая», Михаил Шевко.fb2', '«Вторая», Михаил Шевко.fb2'},
+         'Алексей Толстой': {'«Третья», Алексей Толстой.fb2'}}
+
+
+@pytest.fixture
+def index(tmp_path):
+    # Индекс библиотеки из двух авторов и таблица псевдонимов только для чтения, как при --author.
+
+    aliases = AuthorAliases(str(tmp_path / 'aliases.sqlite'))
+    aliases.learn(BOOKS)
+    aliases.close()
+    index = LibraryIndex(str(tmp_path / 'index.sqlite'))
+    index.update(BOOKS, {}, {key: key for key in BOOKS}, full=True)
+    aliases = AuthorAliases(str(tmp_path / 'aliases.sqlite'), read_only=True)
+    yield index, aliases.signature
+    aliases.close()
+    index.close()
+
+
+@pytest.mark.parametrize('query', ['Михаил Шевко', 'Шевко Михаил', 'М. Шевко', 'Mikhail Shevko', 'Shevko Mikhail'])
+def test_any_spelling_of_author(index, query):
+    assert {book['name'] for book in index[0].books_by_author(query, index[1])} == BOOKS['Михаил Шевко']
+
+
+@pytest.mark.parametrize('query', ['Алексей Шевко', 'Михаил Толстой', 'Шевченко'])
+def test_other_authors(index, query):
+    assert index[0].books_by_author(query, index[1]) == []
@@ -0,0 +1,40 @@
+# Сверка объединения авторов через хеш-индекс с прежней квадратичной реализацией.
+
+import random
+
+import pytest
+
+from bench.micro import compare_and_merge_keys_quadratic, make_author_dict
+from main import compare_and_merge_keys
+
+
+def random_author_dict(rng, count):
+    # Словарь с небольшим числом фамилий, ключами из одного-трех авторов и случайным порядком вставки.
+
+    surnames = [f'Фамилия{number}' for number in range(rng.randint(1, 8))]
+    author_dict = {}
+    for number in range(count):
+        key = ', '.join(f'Имя{rng.randrange(5)} {rng.choice(surnames)}' for _ in range(rng.randint(1, 3)))
+        author_dict.setdefault(key, set()).add(f'book{number}')
+    return author_dict
+
+
+@pytest.mark.parametrize('seed', range(50))
+def test_same_result_as_quadratic(seed):
+    author_dict = random_author_dict(random.Random(seed), random.Random(seed).randint(0, 60))
+    merged = compare_and_merge_keys({key: set(books) for key, books in author_dict.items()})
+    expected = compare_and_merge_keys_quadratic({key: set(books) for key, books in author_dict.items()})
+    assert list(merged.items()) == list(expected.items())  # Те же группы, канонические ключи и порядок
+
+
+def test_same_result_on_benchmark_dict():
+    author_dict = make_author_dict(2000)
+    merged = compare_and_merge_keys({key: set(books) for key, books in author_dict.items()})
+    expected = compare_and_merge_keys_quadratic({key: set(books) for key, books in author_dict.items()})
+    assert list(merged.items()) == list(expected.items())
+
+
+def test_input_is_consumed():
+    author_dict = {'Лев Толстой': {'a'}, 'Толстой': {'b'}}
+    assert compare_and_merge_keys(author_dict) == {'Толстой': {'a', 'b'}}
+    assert author_dict == {}
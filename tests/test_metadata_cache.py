@@ -0,0 +1,52 @@
+# Проверки режима только для чтения (--dry-run): файлы баз не изменяются.
+
+import os
+import sqlite3
+
+from author_names import AuthorAliases
+from metadata_cache import MetadataCache
+
+
+def read(path):
+    with open(path, 'rb') as file:
+        return file.read()
+
+
+def test_read_only_cache_does_not_write(tmp_path):
+    path = str(tmp_path / 'cache.sqlite')
+    connection = sqlite3.connect(path)  # База прежней версии: без таблиц library_files и digests
+    connection.execute('CREATE TABLE metadata (path TEXT PRIMARY KEY, dev INTEGER, inode INTEGER, size INTEGER, '
+                       'mtime_ns INTEGER, format TEXT, title TEXT, authors TEXT, target TEXT)')
+    connection.commit()
+    connection.close()
+    content = read(path)
+
+    book = tmp_path / 'book.fb2'
+    book.write_bytes(b'book')
+    cache = MetadataCache(path, read_only=True)
+    cache.put(str(book), os.stat(book), (str(book), 'fb2', 'Книга', ['Лев Толстой'], {}))
+    assert cache.add_library_files([str(book)]) == 0
+    assert cache.files_of_size(4) == [str(book)]  # Запись видна до закрытия базы
+    cache.close()
+    assert read(path) == content
+    assert sorted(os.listdir(tmp_path)) == ['book.fb2', 'cache.sqlite']
+
+
+def test_read_only_database_is_not_created(tmp_path):
+    MetadataCache(str(tmp_path / 'cache.sqlite'), read_only=True).close()
+    AuthorAliases(str(tmp_path / 'aliases.sqlite'), read_only=True).close()
+    assert os.listdir(tmp_path) == []
+
+
+def test_read_only_aliases_do_not_write(tmp_path):
+    path = str(tmp_path / 'aliases.sqlite')
+    aliases = AuthorAliases(path)
+    aliases.learn(['Лев Толстой'])
+    aliases.close()
+    content = read(path)
+
+    aliases = AuthorAliases(path, read_only=True)
+    aliases.learn(['Антон Чехов', 'Толстой Лев'])
+    assert aliases.signature('Толстой Лев') == aliases.signature('Лев Толстой')
+    aliases.close()
+    assert read(path) == content
@@ -0,0 +1,61 @@
+# Проверки обработки пакетов в режиме наблюдения.
+
+import os
+
+import pytest
+
+from author_names import AuthorAliases
+from bench.corpus import make_fb2
+from config import author_aliases_file, duplicates_folder
+from main import process_books_in_folder
+from watch import process_batch
+
+BOOK = make_fb2('Война', [('Лев', 'Толстой')], 'текст', 'обложка')
+
+
+@pytest.fixture
+def library(tmp_path, monkeypatch):
+    # Библиотека из одной книги "Лев Толстой" после первого прохода.
+    # Возвращает кортеж аргументов process_batch (library, signatures, names, aliases).
+
+    monkeypatch.chdir(tmp_path)
+    os.mkdir('books')
+    write('books/war.fb2', BOOK)
+    library = process_books_in_folder('books')
+    aliases = AuthorAliases(author_aliases_file)
+    yield library, {aliases.signature(key): key for key in library}, set().union(*library.values()), aliases
+    aliases.close()
+
+
+def write(path, content):
+    with open(path, 'wb') as file:
+        file.write(content)
+
+
+def test_duplicate_after_folder_rename(library):
+    write('books/peace.fb2', make_fb2('Мир', [('Толстой', 'Лев')], 'другой текст', 'обложка'))
+    process_batch(['books/peace.fb2'], *library)
+    assert sorted(os.listdir('books/Толстой Лев')) == ['«Война», Лев Толстой.fb2', '«Мир», Толстой Лев.fb2']
+
+    write('books/copy.fb2', BOOK)
+    process_batch(['books/copy.fb2'], *library)
+    assert os.listdir(duplicates_folder) == ['copy.fb2']
+    assert sorted(os.listdir('books/Толстой Лев')) == ['«Война», Лев Толстой.fb2', '«Мир», Толстой Лев.fb2']
+
+
+def test_rename_target_exists(library):
+    write('books/Толстой Лев', b'not a folder')
+    write('books/peace.fb2', make_fb2('Мир', [('Толстой', 'Лев')], 'другой текст', 'обложка'))
+    process_batch(['books/peace.fb2'], *library)
+    with open('books/Толстой Лев', 'rb') as file:
+        assert file.read() == b'not a folder'
+    assert sorted(os.listdir('books/Лев Толстой')) == ['«Война», Лев Толстой.fb2', '«Мир», Толстой Лев.fb2']
+
+
+def test_existing_destination_not_replaced(library):
+    write('books/Лев Толстой/«Мир», Лев Толстой.fb2', b'unlisted book')
+    write('books/peace.fb2', make_fb2('Мир', [('Лев', 'Толстой')], 'другой текст', 'обложка'))
+    library[2].discard('«Мир», Лев Толстой.fb2')
+    process_batch(['books/peace.fb2'], *library)
+    with open('books/Лев Толстой/«Мир», Лев Толстой.fb2', 'rb') as file:
+        assert file.read() == b'unlisted book'
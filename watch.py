@@ -0,0 +1,151 @@
+# Модуль режима наблюдения: новые книги непрерывно раскладываются по папкам авторов пакетами.
+
+import os
+import time
+from author_names import AuthorAliases
+from config import ns_output, metadata_cache_file, library_index_file, move_journal_file, author_aliases_file
+from fb2_output import create_fb2_file
+from library_index import LibraryIndex
+from main import (list_book_files, ingest_files, remember_filed_books, compare_and_merge_keys, author_groups,
+                  plan_books_by_author, process_books_in_folder)
+from metadata_cache import MetadataCache
+from move_plan import MovePlan
+
+try:
+    from inotify_simple import INotify, flags  # Необязательная зависимость, только Linux
+except ImportError:
+    INotify = None
+
+
+def watch_folder(folder, workers=1, full=False, quarantine=True, rollback=False, fs=None, interval=2.0, settle=5.0):
+    # Наблюдает за папкой и обрабатывает новые книги пакетами.
+    # Файл попадает в пакет, когда его размер и время изменения не менялись `settle` секунд,
+    # а пакет обрабатывается, когда в папке `settle` секунд не появлялось новых файлов.
+    # Принимает `folder` - путь к папке с книгами, `workers` - число процессов, `full` - полная пересборка
+    # каталога при первом проходе, `quarantine` - перемещать дубликаты в папку карантина,
+    # `rollback` - откатить прерванный план перемещений и завершить работу без наблюдения, `fs` - объект AsyncFS
+    # для первого прохода, `interval` - период опроса без inotify и `settle` - время ожидания в секундах.
+
+    library = process_books_in_folder(folder, workers, full, quarantine, rollback=rollback, fs=fs)  # Первый проход
+    if rollback:
+        return  # Откатанные книги не раскладываются заново
+    aliases = AuthorAliases(author_aliases_file)  # Таблица псевдонимов, пополненная первым проходом
+    signatures = {aliases.signature(key): key for key in library}  # Индекс папок авторов по каноническим фамилиям
+    names = set().union(*library.values())  # Имена файлов библиотеки
+    notifier = create_notifier(folder)
+    pending = {}  # Путь -> ((размер, mtime_ns), время последнего изменения)
+    ignored = {}  # Файлы, которые не удалось обработать, до их следующего изменения
+    print(f"Watching {folder} ({'inotify' if notifier else 'polling'})")
+
+    while True:
+        wait_for_changes(notifier, interval, settle if pending else None)
+        now = time.monotonic()
+        current = {}
+        for file in list_book_files(folder):
+            try:
+                stat = os.stat(file)
+            except FileNotFoundError:
+                continue
+            state = (stat.st_size, stat.st_mtime_ns)
+            if ignored.get(file) != state:
+                current[file] = state
+        pending = {file: pending[file] if file in pending and pending[file][0] == state else (state, now)
+                   for file, state in current.items()}
+
+        if pending and all(now - changed >= settle for state, changed in pending.values()):
+            batch = list(pending)
+            try:
+                process_batch(batch, library, signatures, names, aliases, workers, quarantine)
+            except Exception as e:
+                print(f"Error processing batch of {len(batch)} files: {e}")  # Наблюдение продолжается
+            for file in batch:
+                if os.path.exists(file):
+                    ignored[file] = pending[file][0]  # Файл остался на месте - обработать не удалось
+            pending = {}
+
+
+def process_batch(files, library, signatures, names, aliases, workers=1, quarantine=True):
+    # Обрабатывает пакет новых файлов, не обходя всю библиотеку: объединение авторов идет по индексу фамилий,
+    # перемещаются только новые книги (одним планом с журналом), каталог обновляется из кэша фрагментов,
+    # а в поисковый индекс добавляются только книги пакета.
+    # Принимает список `files` - пути к файлам, словарь `library` - объединенный словарь авторов библиотеки,
+    # словарь `signatures` - индекс "фамилии -> ключ автора", множество `names` - имена файлов библиотеки,
+    # `aliases` - таблица псевдонимов авторов (AuthorAliases), `workers` - число процессов
+    # и `quarantine` - перемещать дубликаты в папку карантина.
+
+    cache = MetadataCache(metadata_cache_file)
+    author_dict = {}
+    plan = MovePlan()
+    processed = ingest_files(files, author_dict, cache, plan, workers, names, quarantine)
+    keys = list(author_dict)
+    aliases.learn(keys)  # Канонизирует новые имена авторов
+    batch_dict = compare_and_merge_keys(author_dict, aliases.signature)  # Объединяет авторов внутри пакета
+
+    renamed = []
+    filed = {}  # Папка группы -> книги пакета
+    targets = {}  # Ключ группы пакета -> папка группы
+    for key, books in batch_dict.items():
+        signature = aliases.signature(key)
+        folder = existing = signatures.get(signature)
+        if existing is None:
+            folder = key
+        elif existing != key:
+            if os.path.lexists(os.path.join('books', key)):
+                print(f"Error renaming '{existing}': '{os.path.join('books', key)}' already exists")
+            else:
+                # Как и при полном проходе, именем группы становится ключ новой книги
+                plan.add(os.path.join('books', existing), os.path.join('books', key))
+                library[key] = library.pop(existing)
+                renamed.append((existing, key))
+                folder = key
+        filed.setdefault(folder, set()).update(books)
+        library.setdefault(folder, set()).update(books)
+        signatures[signature] = targets[key] = folder
+
+    # Книги библиотеки в папках групп пакета (по путям после переименования), чтобы не перезаписать их
+    path_index = {}
+    previous = {key: existing for existing, key in renamed}
+    for folder in filed:
+        current = os.path.join('books', previous.get(folder, folder))
+        if os.path.isdir(current):
+            for file in os.listdir(current):
+                path_index[file] = os.path.join('books', folder, file)
+    sources = {book: record[0] for book, record in processed.items()}
+    plan_books_by_author(filed, plan, sources, path_index=path_index)  # Папки авторов переименовываются раньше книг
+    plan.execute(move_journal_file)
+    index = LibraryIndex(library_index_file)
+    for existing, key in renamed:
+        if os.path.isdir(os.path.join('books', key)) and not os.path.lexists(os.path.join('books', existing)):
+            cache.rename_folder(os.path.join('books', existing), os.path.join('books', key))
+        index.rename_author(existing, key)
+    create_fb2_file(library, ns_output)  # Перестраиваются только блоки изменившихся авторов
+    remember_filed_books(cache, filed, processed)
+    groups = author_groups(keys, batch_dict, aliases.signature)
+    index.update(filed, processed, {key: targets[group] for key, group in groups.items()})
+    print(f"Filed {len(processed)} of {len(files)} new books")
+    cache.close()
+    index.close()
+
+
+def create_notifier(folder):
+    # Создает наблюдатель inotify за папкой, если он доступен.
+    # Принимает `folder` - путь к папке.
+    # Возвращает объект INotify или None для режима опроса.
+
+    if INotify is None:
+        return None
+    notifier = INotify()
+    notifier.add_watch(folder, flags.CREATE | flags.CLOSE_WRITE | flags.MOVED_TO | flags.MODIFY)
+    return notifier
+
+
+def wait_for_changes(notifier, interval, timeout):
+    # Ожидает изменений в папке.
+    # С inotify блокируется до события или до `timeout` секунд (без ожидающих файлов - бессрочно),
+    # без inotify засыпает на `interval` секунд.
+    # Принимает `notifier` - объект INotify или None, `interval` и `timeout` - время в секундах.
+
+    if notifier is None:
+        time.sleep(interval)
+    else:
+        notifier.read(timeout=None if timeout is None else int(timeout * 1000))